@@ -0,0 +1,36 @@
+"""row versions
+
+version_id on products, profiles and categories, bumped by the ORM on every update. Product detail and
+profile pages build their ETags from it (app/conditional.py).
+
+Revision ID: 24fe8ca25c29
+Revises: df6a1e0ef1d5
+Create Date: 2026-10-18 09:24:28.694334
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '24fe8ca25c29'
+down_revision: Union[str, None] = 'df6a1e0ef1d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ("products", "profiles", "categories")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column("version_id", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("version_id")
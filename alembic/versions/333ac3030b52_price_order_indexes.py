@@ -0,0 +1,51 @@
+"""price order indexes
+
+Indexes for the price orders and price ranges of home() and the API listing, with and without the category and
+location filters. ix_products_deleted_at becomes partial over the soft-deleted rows: as a full index the SQLite
+planner walked it for the deleted_at IS NULL of every listing and sorted the result.
+
+Revision ID: 333ac3030b52
+Revises: 24fe8ca25c29
+Create Date: 2026-10-18 09:27:49.624012
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '333ac3030b52'
+down_revision: Union[str, None] = '24fe8ca25c29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = (
+    ("ix_products_category_price", ["category_id", "price", "id"]),
+    ("ix_products_location_price", ["location_id", "price", "id"]),
+    ("ix_products_category_location_price", ["category_id", "location_id", "price", "id"]),
+)
+
+DELETED = sa.text("deleted_at IS NOT NULL")
+LIVE = sa.text("deleted_at IS NULL")
+
+
+def upgrade() -> None:
+    # Live products only, with the facet columns the price range facet counts read
+    op.create_index("ix_products_price", "products", ["price", "id", "category_id", "location"], sqlite_where=LIVE,
+                    postgresql_where=LIVE)
+    for name, columns in INDEXES:
+        op.create_index(name, "products", columns)
+    op.drop_index("ix_products_deleted_at", table_name="products")
+    op.create_index("ix_products_deleted_at", "products", ["deleted_at"], sqlite_where=DELETED,
+                    postgresql_where=DELETED)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_products_deleted_at", table_name="products")
+    op.create_index("ix_products_deleted_at", "products", ["deleted_at"])
+    for name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name="products")
+    op.drop_index("ix_products_price", table_name="products")
@@ -0,0 +1,32 @@
+"""media derivative widths
+
+derivative_widths on media_files, written once app/thumbnails.py has generated an image's resized copies. Pages
+build their srcsets from it instead of looking for the files. Uploads from before are picked up by running
+`python -m app.thumbnails` once.
+
+Revision ID: 565d8d24a2b7
+Revises: 333ac3030b52
+Create Date: 2026-10-18 10:40:12.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '565d8d24a2b7'
+down_revision: Union[str, None] = '333ac3030b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("media_files") as batch_op:
+        batch_op.add_column(sa.Column("derivative_widths", sa.String(length=50), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("media_files") as batch_op:
+        batch_op.drop_column("derivative_widths")
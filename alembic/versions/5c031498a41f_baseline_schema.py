@@ -0,0 +1,98 @@
+"""baseline schema
+
+The schema as init_db.py's create_all() built it before migrations existed. Databases created that way are
+stamped with this revision by init_db.py and upgraded from here.
+
+Revision ID: 5c031498a41f
+Revises: 
+Create Date: 2026-10-18 08:52:25.049712
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c031498a41f'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(length=50), nullable=False, unique=True),
+        sa.Column("password", sa.String(), nullable=False),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+
+    op.create_table(
+        "categories",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(length=50), nullable=False, unique=True),
+    )
+    op.create_index("ix_categories_id", "categories", ["id"])
+
+    op.create_table(
+        "profiles",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), unique=True),
+        sa.Column("profile_picture", sa.String(), nullable=True),
+        sa.Column("location", sa.String(length=100), nullable=True),
+        sa.Column("bio", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_profiles_id", "profiles", ["id"])
+
+    op.create_table(
+        "products",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(length=100), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("price", sa.Integer(), nullable=True),
+        sa.Column("image", sa.String(), nullable=True),
+        sa.Column("location", sa.String(length=50), nullable=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("category_id", sa.Integer(), sa.ForeignKey("categories.id"), nullable=True),
+    )
+    op.create_index("ix_products_id", "products", ["id"])
+
+    op.create_table(
+        "media_files",
+        sa.Column("path", sa.String(), primary_key=True),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("content_type", sa.String(length=50), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+    )
+
+    # Full-text search index, see app/search.py
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("""
+            CREATE TABLE product_search (
+                product_id INTEGER PRIMARY KEY REFERENCES products (id) ON DELETE CASCADE,
+                document TSVECTOR NOT NULL
+            )
+        """)
+        op.execute("CREATE INDEX ix_product_search_document ON product_search USING GIN (document)")
+    else:
+        op.execute("""
+            CREATE VIRTUAL TABLE product_fts USING fts5(
+                name, location, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_table("product_search")
+    else:
+        op.execute("DROP TABLE product_fts")
+    op.drop_table("media_files")
+    op.drop_table("products")
+    op.drop_table("profiles")
+    op.drop_table("categories")
+    op.drop_table("users")
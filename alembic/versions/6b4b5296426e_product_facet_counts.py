@@ -0,0 +1,41 @@
+"""product facet counts
+
+Summary table of product counts per (category, location) pair behind the home page's facet counts, filled
+from the existing products. The application keeps it current from here on.
+
+Revision ID: 6b4b5296426e
+Revises: 73e56b67d426
+Create Date: 2026-10-18 09:03:26.239808
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b4b5296426e'
+down_revision: Union[str, None] = '73e56b67d426'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "product_facets",
+        sa.Column("category_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("location", sa.String(length=50), nullable=False),
+        sa.Column("product_count", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("category_id", "location"),
+    )
+    op.execute("""
+        INSERT INTO product_facets (category_id, location, product_count)
+        SELECT coalesce(category_id, 0), coalesce(location, ''), count(*)
+        FROM products
+        GROUP BY coalesce(category_id, 0), coalesce(location, '')
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("product_facets")
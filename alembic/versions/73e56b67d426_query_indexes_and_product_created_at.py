@@ -0,0 +1,45 @@
+"""query indexes and product created_at
+
+Indexes for the product filters of home(), the seller's listing and product ownership checks, plus a
+created_at timestamp. Existing products get the time of the migration.
+
+Revision ID: 73e56b67d426
+Revises: 5c031498a41f
+Create Date: 2026-10-18 08:52:35.632709
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '73e56b67d426'
+down_revision: Union[str, None] = '5c031498a41f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # SQLite can't add a column with a non-constant default in place, the table is copied there
+    recreate = "always" if op.get_bind().dialect.name == "sqlite" else "auto"
+    with op.batch_alter_table("products", recreate=recreate) as batch_op:
+        batch_op.add_column(
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+        )
+        batch_op.create_index("ix_products_created_at", ["created_at"])
+        batch_op.create_index("ix_products_user_id", ["user_id"])
+        batch_op.create_index("ix_products_category", ["category_id", "id"])
+        batch_op.create_index("ix_products_location", ["location", "id"])
+        batch_op.create_index("ix_products_category_location", ["category_id", "location", "id"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_index("ix_products_category_location")
+        batch_op.drop_index("ix_products_location")
+        batch_op.drop_index("ix_products_category")
+        batch_op.drop_index("ix_products_user_id")
+        batch_op.drop_index("ix_products_created_at")
+        batch_op.drop_column("created_at")
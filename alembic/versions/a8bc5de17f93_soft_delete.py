@@ -0,0 +1,36 @@
+"""soft delete
+
+deleted_at on users and products: deleting hides the rows at once, app/cleanup.py purges them later.
+
+Revision ID: a8bc5de17f93
+Revises: 6b4b5296426e
+Create Date: 2026-10-18 09:06:45.815052
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8bc5de17f93'
+down_revision: Union[str, None] = '6b4b5296426e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.add_column(sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+        batch_op.create_index("ix_products_deleted_at", ["deleted_at"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_index("ix_products_deleted_at")
+        batch_op.drop_column("deleted_at")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("deleted_at")
@@ -0,0 +1,94 @@
+"""normalized locations
+
+A locations table referenced by products.location_id. Existing spellings are deduplicated the way
+app/locations.py normalizes them, the most common spelling becomes the location's name and is written back to
+products.location, and the facet counts are recounted. The product location indexes move to location_id.
+Downgrading keeps the canonical spellings.
+
+Revision ID: df6a1e0ef1d5
+Revises: a8bc5de17f93
+Create Date: 2026-10-18 09:10:03.856601
+
+"""
+from typing import Sequence, Union
+
+from collections import Counter, defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'df6a1e0ef1d5'
+down_revision: Union[str, None] = 'a8bc5de17f93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def clean_location(text):
+    # Frozen copy of app/locations.py at this revision
+    return " ".join((text or "").split(",")[0].split())[:50]
+
+
+def upgrade() -> None:
+    locations = op.create_table(
+        "locations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=50), nullable=False),
+        sa.Column("key", sa.String(length=50), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("key"),
+    )
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.add_column(sa.Column("location_id", sa.Integer(), nullable=True))
+        batch_op.create_foreign_key("fk_products_location_id_locations", "locations", ["location_id"], ["id"])
+        batch_op.drop_index("ix_products_category_location")
+        batch_op.drop_index("ix_products_location")
+        batch_op.create_index("ix_products_location", ["location_id", "id"])
+        batch_op.create_index("ix_products_category_location", ["category_id", "location_id", "id"])
+
+    connection = op.get_bind()
+    spellings = defaultdict(Counter)
+    for location, count in connection.execute(sa.text(
+        "SELECT location, count(*) FROM products WHERE location IS NOT NULL GROUP BY location"
+    )):
+        name = clean_location(location)
+        if name:
+            spellings[name.casefold()[:50]][name] += count
+    if spellings:
+        op.bulk_insert(locations, [
+            {"key": key, "name": counts.most_common(1)[0][0]} for key, counts in spellings.items()
+        ])
+        ids = dict(connection.execute(sa.text("SELECT key, id FROM locations")).all())
+        names = {key: counts.most_common(1)[0][0] for key, counts in spellings.items()}
+        originals = connection.execute(sa.text("SELECT DISTINCT location FROM products WHERE location IS NOT NULL"))
+        updates = []
+        for (location,) in originals:
+            # Blank spellings ("  ", ", DE") become no location
+            key = clean_location(location).casefold()[:50]
+            updates.append({"original": location, "location_id": ids.get(key), "name": names.get(key)})
+        connection.execute(
+            sa.text("UPDATE products SET location_id = :location_id, location = :name WHERE location = :original"),
+            updates,
+        )
+
+    # Facets are keyed by the location's name, which just changed for the merged spellings
+    op.execute("DELETE FROM product_facets")
+    op.execute("""
+        INSERT INTO product_facets (category_id, location, product_count)
+        SELECT coalesce(category_id, 0), coalesce(location, ''), count(*)
+        FROM products
+        WHERE deleted_at IS NULL
+        GROUP BY coalesce(category_id, 0), coalesce(location, '')
+    """)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_index("ix_products_category_location")
+        batch_op.drop_index("ix_products_location")
+        batch_op.create_index("ix_products_location", ["location", "id"])
+        batch_op.create_index("ix_products_category_location", ["category_id", "location", "id"])
+        batch_op.drop_constraint("fk_products_location_id_locations", type_="foreignkey")
+        batch_op.drop_column("location_id")
+    op.drop_table("locations")
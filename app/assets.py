@@ -0,0 +1,153 @@
+# app/assets.py
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+
+import brotli
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+from app.media import STATIC_DIR
+
+# Static asset pipeline. `python -m app.assets` mirrors app/static into app/static/build, adds a
+# content-hashed copy of every asset (style.css -> style.<hash>.css) with .gz and .br siblings, and
+# writes manifest.json mapping original paths to the hashed ones. Templates resolve
+# url_for('static', ...) through the manifest; AssetStaticFiles serves hashed files as immutable,
+# picking the precompressed variant the client accepts. Without a build everything is served as before.
+
+BUILD_DIR = "build"
+MANIFEST = os.path.join(STATIC_DIR, BUILD_DIR, "manifest.json")
+
+# Uploads and repository screenshots are not part of the build
+SKIP_DIRS = {BUILD_DIR, "media", "readme"}
+COMPRESSIBLE = {".css", ".js", ".map", ".svg", ".json", ".txt", ".eot", ".ttf", ".otf", ".ico"}
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_manifest = None
+
+
+def load_manifest() -> dict:
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST) as f:
+                _manifest = json.load(f)
+        except FileNotFoundError:
+            _manifest = {}
+    return _manifest
+
+
+def asset_path(path: str) -> str:
+    return load_manifest().get(path, path)
+
+
+@pass_context
+def url_for(context, name: str, /, **path_params):
+    # Replaces the url_for template global: static paths resolve to their fingerprinted build copy
+    if name == "static" and "path" in path_params:
+        path_params["path"] = asset_path(path_params["path"])
+    return context["request"].url_for(name, **path_params)
+
+
+def _write_compressed(path: str, data: bytes):
+    for _, extension in ENCODINGS:
+        compressed = brotli.compress(data, quality=11) if extension == ".br" else gzip.compress(data, 9, mtime=0)
+        # Only worth serving when it actually saves bytes
+        if len(compressed) < len(data):
+            with open(path + extension, "wb") as f:
+                f.write(compressed)
+
+
+def build():
+    build_root = os.path.join(STATIC_DIR, BUILD_DIR)
+    shutil.rmtree(build_root, ignore_errors=True)
+    manifest = {}
+
+    for directory, subdirs, filenames in os.walk(STATIC_DIR):
+        relative_dir = os.path.relpath(directory, STATIC_DIR)
+        if relative_dir == ".":
+            subdirs[:] = [d for d in subdirs if d not in SKIP_DIRS]
+            relative_dir = ""
+        for filename in filenames:
+            source = os.path.join(directory, filename)
+            relative = "/".join(filter(None, [relative_dir.replace(os.sep, "/"), filename]))
+            with open(source, "rb") as f:
+                data = f.read()
+
+            stem, extension = os.path.splitext(filename)
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = "/".join(filter(None, [BUILD_DIR, relative_dir.replace(os.sep, "/"), f"{stem}.{digest}{extension}"]))
+
+            # The plain copy keeps relative references between assets (fonts, images, source maps) working
+            for target in (os.path.join(build_root, relative), os.path.join(STATIC_DIR, hashed)):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as f:
+                    f.write(data)
+                if extension.lower() in COMPRESSIBLE:
+                    _write_compressed(target, data)
+            manifest[relative] = hashed
+
+    with open(MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetStaticFiles(StaticFiles):
+    # StaticFiles serving the build output: precompressed variants by Accept-Encoding and
+    # immutable caching for fingerprinted names. Uploaded media is revalidated through its ETag.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._immutable = set(load_manifest().values())
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        relative = os.path.relpath(full_path, os.path.realpath(self.directory)).replace(os.sep, "/")
+        request_headers = Headers(scope=scope)
+
+        if relative.startswith(BUILD_DIR + "/"):
+            response = self._precompressed_response(full_path, request_headers) \
+                or FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+            response.headers["vary"] = "Accept-Encoding"
+            if relative in self._immutable:
+                response.headers["cache-control"] = IMMUTABLE
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+            if relative.startswith("media/"):
+                response.headers["cache-control"] = REVALIDATE
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _precompressed_response(self, full_path, request_headers):
+        accepted = {
+            value.split(";")[0].strip().lower()
+            for value in request_headers.get("accept-encoding", "").split(",")
+        }
+        for encoding, extension in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                compressed_stat = os.stat(full_path + extension)
+            except FileNotFoundError:
+                continue
+            # Type of the original file, not of the .br/.gz wrapper
+            media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+            response = FileResponse(full_path + extension, stat_result=compressed_stat, media_type=media_type)
+            response.headers["content-encoding"] = encoding
+            return response
+        return None
+
+
+if __name__ == "__main__":
+    built = build()
+    print(f"Fingerprinted {len(built)} assets into {os.path.join(STATIC_DIR, BUILD_DIR)}", file=sys.stderr)
@@ -0,0 +1,268 @@
+# app/bulk.py
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import SessionLocal, engine
+from app.facets import adjust_facets
+from app.locations import resolve_locations
+from app.media import PRODUCT_IMAGES, DEFAULT_IMAGES, DEFAULT_PRODUCT_IMAGE, STATIC_DIR, store_file, add_references
+from app.models import Category, Product, User
+from app.search import index_rows
+from app.thumbnails import schedule_derivatives, drain_derivatives
+
+# Bulk product import and export, for onboarding large sellers without one POST per listing:
+#
+#   python -m app.bulk import listings.csv --user alice --images-dir ./photos
+#   python -m app.bulk export listings.jsonl
+#
+# Files are CSV or JSON lines (by extension, or --format) with the columns of EXPORT_FIELDS. Rows are read and
+# written in chunks, so memory stays flat however large the file is: each chunk resolves its categories, sellers
+# and locations in one query each, copies its images on a thread pool and inserts its products in one statement
+# (COPY on Postgres). Thumbnails of a committed chunk are generated while the next ones import, at most about
+# two chunks' worth queued. Running servers pick the new listings up once their page and reference caches expire.
+
+EXPORT_FIELDS = ("name", "description", "price", "location", "category", "image", "username")
+PRODUCT_COLUMNS = ("id", "name", "description", "price", "location", "location_id", "image", "category_id", "user_id")
+
+
+def detect_format(path: str, fmt: str = None) -> str:
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt in ("jsonl", "ndjson"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise SystemExit(f"Unknown format for {path}, use --format csv or --format jsonl")
+
+
+def read_rows(f, fmt: str):
+    # Lazily yields (line number, dict)
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield line_number, json.loads(line)
+
+
+def chunked(rows, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Progress:
+    def __init__(self, verb: str):
+        self.verb = verb
+        self.rows = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    def report(self, final: bool = False):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        skipped = f", {self.skipped} skipped" if self.skipped else ""
+        end = "\n" if final else "\r"
+        print(f"{self.verb} {self.rows} rows{skipped} in {elapsed:.1f}s ({rate:.0f} rows/s)", end=end, file=sys.stderr)
+
+
+async def resolve_ids(db: AsyncSession, model, column, names, known: dict, create: bool):
+    # Fill `known` (name -> id) for every name of the chunk, with one SELECT and, for categories, one
+    # INSERT of the missing ones
+    missing = {name for name in names if name not in known}
+    if missing:
+        rows = await db.execute(select(column, model.id).where(column.in_(missing)))
+        known.update(rows.all())
+    missing -= known.keys()
+    if missing and create:
+        created = await db.execute(insert(model).returning(column, model.id), [{column.key: name} for name in missing])
+        known.update(created.all())
+
+
+async def copy_products(db: AsyncSession, rows: list):
+    # Postgres: reserve ids from the sequence, then COPY the rows in with asyncpg
+    ids = (await db.execute(
+        select(func.nextval(func.pg_get_serial_sequence("products", "id"))).select_from(func.generate_series(1, len(rows)))
+    )).scalars().all()
+    for row, product_id in zip(rows, ids):
+        row["id"] = product_id
+    connection = await (await db.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table(
+        "products", records=[tuple(row[column] for column in PRODUCT_COLUMNS) for row in rows], columns=PRODUCT_COLUMNS,
+    )
+
+
+async def insert_products(db: AsyncSession, rows: list):
+    if db.bind.dialect.name == "postgresql":
+        await copy_products(db, rows)
+        return
+    ids = (await db.execute(insert(Product).returning(Product.id, sort_by_parameter_order=True), rows)).scalars().all()
+    for row, product_id in zip(rows, ids):
+        row["id"] = product_id
+
+
+def parse_row(line_number: int, row: dict, default_user: str):
+    # Validated product fields from one input row, or a reason to skip it
+    name = (row.get("name") or "").strip()
+    category = (row.get("category") or "").strip()
+    username = (row.get("username") or default_user or "").strip()
+    if not name:
+        return None, f"line {line_number}: missing name"
+    if not category:
+        return None, f"line {line_number}: missing category"
+    if not username:
+        return None, f"line {line_number}: no username column and no --user"
+    try:
+        price = int(row["price"]) if row.get("price") not in (None, "") else None
+    except (TypeError, ValueError):
+        return None, f"line {line_number}: price {row.get('price')!r} is not a whole number"
+    return {
+        "name": name[:100],
+        "description": row.get("description") or "",
+        "price": price,
+        "location": (row.get("location") or "")[:50],
+        "category": category[:50],
+        "image": (row.get("image") or "").strip(),
+        "username": username,
+    }, None
+
+
+async def import_products(path: str, fmt: str, default_user: str, images_dir: str, chunk_size: int, image_workers: int):
+    progress = Progress("Imported")
+    categories = {}
+    users = {}
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix="bulk-images") as pool, \
+            open(path, newline="", encoding="utf-8") as f:
+        for chunk in chunked(read_rows(f, fmt), chunk_size):
+            parsed = []
+            for line_number, row in chunk:
+                product, error = parse_row(line_number, row, default_user)
+                if error:
+                    progress.skipped += 1
+                    print(f"Skipping {error}", file=sys.stderr)
+                else:
+                    parsed.append((line_number, product))
+
+            async with SessionLocal() as db:
+                await resolve_ids(db, User, User.username, {p["username"] for _, p in parsed}, users, create=False)
+                for line_number, product in parsed:
+                    if product["username"] not in users:
+                        progress.skipped += 1
+                        print(f"Skipping line {line_number}: unknown user {product['username']!r}", file=sys.stderr)
+                parsed = [(line_number, product) for line_number, product in parsed if product["username"] in users]
+                await resolve_ids(db, Category, Category.name, {p["category"] for _, p in parsed}, categories, create=True)
+                locations = await resolve_locations(db, {p["location"] for _, p in parsed})
+
+                # Copy the chunk's images in parallel, a row whose image can't be stored is skipped
+                async def store(image):
+                    if not image or image in DEFAULT_IMAGES:
+                        return None
+                    return await loop.run_in_executor(pool, store_file, os.path.join(images_dir, image), PRODUCT_IMAGES)
+
+                stored = await asyncio.gather(*(store(p["image"]) for _, p in parsed), return_exceptions=True)
+
+                rows = []
+                files = []
+                for (line_number, product), image in zip(parsed, stored):
+                    if isinstance(image, Exception):
+                        progress.skipped += 1
+                        print(f"Skipping line {line_number}: {image}", file=sys.stderr)
+                        continue
+                    if image:
+                        files.append(image)
+                    rows.append({
+                        "name": product["name"],
+                        "description": product["description"],
+                        "price": product["price"],
+                        "location": locations[product["location"]][1],
+                        "location_id": locations[product["location"]][0],
+                        "image": image[0] if image else DEFAULT_PRODUCT_IMAGE,
+                        "category_id": categories[product["category"]],
+                        "user_id": users[product["username"]],
+                    })
+
+                if rows:
+                    await insert_products(db, rows)
+                    await add_references(db, files)
+                    await index_rows(db, rows)
+                    await adjust_facets(db, [(row["category_id"], row["location"], 1) for row in rows])
+                await db.commit()
+
+            # Thumbnails of the committed chunk, after the backlog of earlier chunks is down to a chunk's worth
+            await drain_derivatives(chunk_size)
+            for image in dict.fromkeys(image[0] for image in files):
+                schedule_derivatives(image)
+            progress.rows += len(rows)
+            progress.report()
+
+        await drain_derivatives()
+    progress.report(final=True)
+
+
+async def export_products(path: str, fmt: str, chunk_size: int):
+    progress = Progress("Exported")
+    query = (
+        select(Product.name, Product.description, Product.price, Product.location, Category.name.label("category"),
+               Product.image, User.username)
+        .outerjoin(Category, Product.category_id == Category.id)
+        .outerjoin(User, Product.user_id == User.id)
+        .order_by(Product.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    async with SessionLocal() as db:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS) if fmt == "csv" else None
+            if writer:
+                writer.writeheader()
+            result = await db.stream(query)
+            async for partition in result.partitions():
+                for row in partition:
+                    record = dict(zip(EXPORT_FIELDS, row))
+                    if writer:
+                        writer.writerow(record)
+                    else:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                progress.rows += len(partition)
+                progress.report()
+    progress.report(final=True)
+
+
+async def main(args):
+    fmt = detect_format(args.file, args.format)
+    try:
+        if args.command == "import":
+            await import_products(args.file, fmt, args.user, args.images_dir, args.chunk_size, args.image_workers)
+        else:
+            await export_products(args.file, fmt, args.chunk_size)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk product import and export")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", help="CSV or JSON lines file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="file format, by default from the extension")
+    parser.add_argument("--user", help="seller for rows without a username column")
+    parser.add_argument("--images-dir", default=STATIC_DIR,
+                        help="directory the image column is relative to (default: app/static, as exported)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per batch")
+    parser.add_argument("--image-workers", type=int, default=4, help="threads copying images")
+    asyncio.run(main(parser.parse_args()))
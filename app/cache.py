@@ -0,0 +1,185 @@
+# app/cache.py
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+
+# Registry of every cache in the process, reported by the /cache/stats endpoint
+caches = {}
+
+_MISSING = object()
+
+
+class TTLCache:
+    # Small in-process cache: entries expire after `ttl` seconds or when invalidated explicitly.
+    # Each worker keeps its own copy, so the TTL bounds how stale another worker's writes can look.
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        # Bumped by every invalidation, so a load that started before one doesn't store what it read
+        self._generation = 0
+        caches[name] = self
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        # Drop one key, or everything when no key is given
+        self.invalidations += 1
+        self._generation += 1
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def get_or_load(self, key, loader):
+        # Return the cached value, or await loader() and cache its result unless the cache was invalidated while
+        # it ran; the caller still gets the result, the next lookup loads again
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            generation = self._generation
+            value = await loader()
+            if generation == self._generation:
+                self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+        }
+
+
+class LRUCache(TTLCache):
+    # TTL cache bounded to `maxsize` entries, evicting the least recently used one first
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        self.maxsize = maxsize
+        self.evictions = 0
+        super().__init__(name, ttl)
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        value = super().get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        super().set(key, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._evicted(evicted)
+
+    def _evicted(self, key):
+        pass
+
+    def stats(self) -> dict:
+        return {**super().stats(), "maxsize": self.maxsize, "evictions": self.evictions}
+
+
+class PageCache(LRUCache):
+    # LRU of rendered pages. Entries carry tags ("home", "product:3", ...) so writes can drop exactly
+    # the pages they affect, and concurrent misses on one key share a single render (single-flight)
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        super().__init__(name, ttl, maxsize)
+        self._tagged = defaultdict(set)
+        self._tags_of = {}
+        self._inflight = {}
+        self.coalesced = 0
+
+    def set(self, key, value, tags=()):
+        self._evicted(key)
+        self._tags_of[key] = tuple(tags)
+        for tag in tags:
+            self._tagged[tag].add(key)
+        super().set(key, value)
+
+    def invalidate_tags(self, *tags):
+        self.invalidations += 1
+        self._generation += 1
+        # Renders already running may have read the old rows: requests from now on don't wait for them
+        self._inflight.clear()
+        for tag in tags:
+            for key in self._tagged.pop(tag, ()):
+                self._entries.pop(key, None)
+                self._tags_of.pop(key, None)
+
+    def invalidate(self, key=None):
+        super().invalidate(key)
+        self._inflight.clear()
+        if key is None:
+            self._tagged.clear()
+            self._tags_of.clear()
+        else:
+            self._evicted(key)
+
+    def _evicted(self, key):
+        for tag in self._tags_of.pop(key, ()):
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    async def get_or_render(self, key, render):
+        # render() returns (page, tags) or (page, None) for pages that must not be cached. A page whose render
+        # overlapped an invalidation is returned but not stored, it may show what the write replaced
+        page = self.get(key, _MISSING)
+        if page is not _MISSING:
+            return page
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            page, tags = await render()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters get the error, nobody else has to retrieve it
+            future.exception()
+            raise
+        else:
+            if tags is not None and generation == self._generation:
+                self.set(key, page, tags)
+            future.set_result(page)
+            return page
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {**super().stats(), "coalesced": self.coalesced}
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -0,0 +1,202 @@
+# app/cleanup.py
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import delete, exists, select
+from starlette.concurrency import run_in_threadpool
+
+from app.database import SessionLocal, engine
+from app.media import STATIC_DIR, PRODUCT_IMAGES, PROFILE_PICS, DERIVATIVES, DEFAULT_IMAGES, release_many, \
+    delete_files
+from app.models import MediaFile, Product, Profile, User
+from app.query_budget import detached_task
+from app.search import remove_products
+from config import PURGE_BATCH_SIZE, PURGE_INTERVAL, MEDIA_SWEEP_INTERVAL, MEDIA_SWEEP_GRACE
+
+logger = logging.getLogger(__name__)
+
+# Deleting a product or an account only sets deleted_at, which hides the rows from every query (see
+# models.SoftDelete), and wakes the worker here up. The worker deletes the rows, search documents and media
+# references in batches of bulk statements and removes the files nothing references any more. Every few hours it
+# also sweeps the upload directories for files no row knows about. Each app process runs one worker; on
+# Postgres concurrent purges skip each other's rows. `python -m app.cleanup [--sweep]` runs a pass by hand
+
+INCLUDE_DELETED = {"include_deleted": True}
+
+
+async def _purge_products(db) -> tuple:
+    # One batch of soft-deleted products: (rows purged, files to delete after commit)
+    rows = (await db.execute(
+        select(Product.id, Product.image)
+        .where(Product.deleted_at.is_not(None))
+        .order_by(Product.id)
+        .limit(PURGE_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .execution_options(**INCLUDE_DELETED)
+    )).all()
+    if not rows:
+        return 0, []
+    ids = [row.id for row in rows]
+    await remove_products(db, ids)
+    orphaned_files = await release_many(db, [row.image for row in rows])
+    await db.execute(delete(Product).where(Product.id.in_(ids)).execution_options(synchronize_session=False))
+    return len(rows), orphaned_files
+
+
+async def _purge_users(db) -> tuple:
+    # One batch of deleted accounts whose products are gone, with their profiles
+    ids = list(await db.scalars(
+        select(User.id)
+        .where(User.deleted_at.is_not(None), ~exists().where(Product.user_id == User.id))
+        .limit(PURGE_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .execution_options(**INCLUDE_DELETED)
+    ))
+    if not ids:
+        return 0, []
+    pictures = await db.scalars(select(Profile.profile_picture).where(Profile.user_id.in_(ids)))
+    orphaned_files = await release_many(db, list(pictures))
+    await db.execute(delete(Profile).where(Profile.user_id.in_(ids)).execution_options(synchronize_session=False))
+    await db.execute(delete(User).where(User.id.in_(ids)).execution_options(synchronize_session=False))
+    return len(ids), orphaned_files
+
+
+async def purge_deleted() -> int:
+    # Products first, an account goes once its last product has
+    purged = 0
+    for purge_batch in (_purge_products, _purge_users):
+        while True:
+            async with SessionLocal() as db:
+                count, orphaned_files = await purge_batch(db)
+                await db.commit()
+            await delete_files(orphaned_files)
+            purged += count
+            if count < PURGE_BATCH_SIZE:
+                break
+    if purged:
+        logger.info("Purged %d deleted rows", purged)
+    return purged
+
+
+def _upload_files(cutoff: float):
+    # Files of the upload directories last modified before `cutoff`, relative to STATIC_DIR
+    paths = []
+    for directory in (PRODUCT_IMAGES, PROFILE_PICS):
+        with os.scandir(os.path.join(STATIC_DIR, directory)) as entries:
+            for entry in entries:
+                path = f"{directory}/{entry.name}"
+                if entry.is_file() and path not in DEFAULT_IMAGES and entry.stat().st_mtime < cutoff:
+                    paths.append(path)
+    return paths
+
+
+def _orphaned_derivatives():
+    # Resized copies whose original is gone, e.g. after a crash between commit and delete_files()
+    orphaned = []
+    for directory in (PRODUCT_IMAGES, PROFILE_PICS):
+        originals = {os.path.splitext(name)[0] for name in os.listdir(os.path.join(STATIC_DIR, directory))}
+        derivatives = os.path.join(STATIC_DIR, DERIVATIVES, os.path.basename(directory))
+        if not os.path.isdir(derivatives):
+            continue
+        for name in os.listdir(derivatives):
+            if os.path.splitext(name)[0].rsplit("_", 1)[0] not in originals:
+                orphaned.append(os.path.join(derivatives, name))
+    for path in orphaned:
+        os.remove(path)
+    return len(orphaned)
+
+
+async def sweep_media() -> int:
+    # Reconcile the upload directories with the database: drop media rows without references, then delete
+    # files older than MEDIA_SWEEP_GRACE that neither media_files nor any product or profile refers to
+    candidates = await run_in_threadpool(_upload_files, time.time() - MEDIA_SWEEP_GRACE)
+    removed = []
+    async with SessionLocal() as db:
+        stale = list(await db.scalars(select(MediaFile.path).where(MediaFile.ref_count <= 0)))
+        if stale:
+            await db.execute(delete(MediaFile).where(MediaFile.path.in_(stale)))
+            await db.commit()
+        removed += stale
+
+        for start in range(0, len(candidates), PURGE_BATCH_SIZE):
+            chunk = candidates[start:start + PURGE_BATCH_SIZE]
+            known = set(await db.scalars(select(MediaFile.path).where(MediaFile.path.in_(chunk))))
+            # Uploads from before content addressing have no media_files row, look for rows using them directly
+            unknown = [path for path in chunk if path not in known]
+            if unknown:
+                known.update(await db.scalars(
+                    select(Product.image).where(Product.image.in_(unknown)).execution_options(**INCLUDE_DELETED)
+                ))
+                known.update(await db.scalars(select(Profile.profile_picture).where(Profile.profile_picture.in_(unknown))))
+            removed += [path for path in chunk if path not in known]
+
+    await delete_files(removed)
+    derivatives = await run_in_threadpool(_orphaned_derivatives)
+    if removed or derivatives:
+        logger.info("Media sweep removed %d files and %d resized copies", len(removed), derivatives)
+    return len(removed)
+
+
+_worker = None
+_wakeup = None
+
+
+async def _run():
+    next_sweep = time.monotonic() + MEDIA_SWEEP_INTERVAL
+    while True:
+        try:
+            await purge_deleted()
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + MEDIA_SWEEP_INTERVAL
+                await sweep_media()
+        except Exception:
+            logger.exception("Cleanup pass failed, retrying in %s seconds", PURGE_INTERVAL)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=PURGE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_worker():
+    # Idempotent; the first pass picks up deletions a previous process didn't get to
+    global _worker, _wakeup
+    if _worker is None or _worker.done():
+        _wakeup = asyncio.Event()
+        _worker = detached_task(_run())
+
+
+async def stop_worker():
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
+
+
+def schedule_purge():
+    # Called once a soft delete has committed
+    start_worker()
+    _wakeup.set()
+
+
+async def main(sweep: bool):
+    try:
+        await purge_deleted()
+        if sweep:
+            await sweep_media()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Purge deleted products and accounts")
+    parser.add_argument("--sweep", action="store_true", help="also delete upload files no row references")
+    asyncio.run(main(parser.parse_args().sweep))
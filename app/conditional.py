@@ -0,0 +1,57 @@
+# app/conditional.py
+import hashlib
+import json
+
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+
+from app.assets import load_manifest
+from config import templates
+
+# Conditional GET for pages built from a few rows. Product, Profile and Category carry a version_id the ORM bumps
+# on every UPDATE; a route reads just those versions (one indexed query), hashes them with the viewer and this
+# deploy's templates and asset fingerprints into a weak ETag, and answers If-None-Match with 304 before loading
+# rows or rendering. Anything else the page shows, like which images have resized copies, goes in the same query:
+# process-local state differs between workers. Weak, since CompressionMiddleware sends the same page in several
+# encodings
+
+REVALIDATE = "private, no-cache"
+
+_deploy = None
+
+
+def _deploy_token() -> str:
+    # Template sources and the static manifest: a deploy changing either changes every page's ETag
+    global _deploy
+    if _deploy is None:
+        digest = hashlib.sha256(json.dumps(load_manifest(), sort_keys=True).encode())
+        for name in sorted(templates.env.list_templates()):
+            digest.update(name.encode())
+            digest.update(templates.env.loader.get_source(templates.env, name)[0].encode())
+        _deploy = digest.hexdigest()
+    return _deploy
+
+
+def page_etag(*parts):
+    digest = hashlib.sha256(_deploy_token().encode())
+    digest.update(repr(parts).encode())
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def not_modified(request, etag):
+    # The 304 to return when the client's copy is current, else None
+    if etag is None:
+        return None
+    if_none_match = Headers(scope=request.scope).get("if-none-match", "")
+    # Weak comparison, as If-None-Match requires
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in tags or etag.removeprefix("W/") in tags:
+        return NotModifiedResponse({"etag": etag, "cache-control": REVALIDATE})
+    return None
+
+
+def with_etag(response, etag):
+    if etag is not None:
+        response.headers["etag"] = etag
+        response.headers["cache-control"] = REVALIDATE
+    return response
@@ -1,21 +1,39 @@
 # app/crud.py
+import base64
+import json
 from datetime import timedelta, datetime, timezone
 
 from fastapi import Depends, Request
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from app.database import get_db
-from app.models import User, Profile
-from app.schemas import UserCreate
-from config import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.cache import TTLCache, LRUCache, PageCache
+from app.database import get_read_db
+from app.cleanup import schedule_purge
+from app.facets import remove_seller_facets, load_facet_rows, filtered_facet_rows, fold_facets
+from app.locations import location_key
+from app.models import User, Profile, Product, Category, Location
+from app.passwords import hash_password, verify_and_update
+from app.schemas import UserCreate, CurrentUser, ProfileSummary
+from app.search import search_ranking
+from app.suggestions import product_suggestions
+from config import ACCESS_TOKEN_EXPIRE_MINUTES, PAGE_SIZE, REFERENCE_CACHE_TTL, PRINCIPAL_CACHE_SIZE, \
+    PRINCIPAL_CACHE_TTL, JWT_PRINCIPAL_CLAIMS, PAGE_CACHE_SIZE, PAGE_CACHE_TTL
 from . import SECRET_KEY, ALGORITHM
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Category list and facet counts, read on every page view but rarely written
+reference_cache = TTLCache("reference_data", ttl=REFERENCE_CACHE_TTL)
 
+# CurrentUser by username, so authenticated requests don't query the user and profile every time
+principal_cache = LRUCache("principals", ttl=PRINCIPAL_CACHE_TTL, maxsize=PRINCIPAL_CACHE_SIZE)
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+# Rendered pages for anonymous visitors, tagged "home", "product:<id>" and "user:<id>"
+page_cache = PageCache("pages", ttl=PAGE_CACHE_TTL, maxsize=PAGE_CACHE_SIZE)
+
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_read_db)):
     # Retrieve the token from the cookies
     token = request.cookies.get("access_token")
 
@@ -32,18 +50,57 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     except JWTError:
         return None
 
-    user = get_user_by_username(db, username=username)
-    if user is None:
-        return None
-    return user
+    # Writes always check the account in the database: claims and other processes' principal caches only
+    # learn about a deleted account when they expire
+    writes = request.method not in ("GET", "HEAD", "OPTIONS")
+
+    # Tokens carrying the principal claims need no lookup at all
+    if JWT_PRINCIPAL_CLAIMS and not writes and "uid" in payload and "pic" in payload:
+        return CurrentUser(id=payload["uid"], username=username, profile=ProfileSummary(profile_picture=payload["pic"]))
+
+    principal = None if writes else principal_cache.get(username)
+    if principal is None:
+        user = await get_user_by_username(db, username=username)
+        if user is None:
+            return None
+        principal = CurrentUser.model_validate(user)
+        principal_cache.set(username, principal)
+    return principal
+
 
+def invalidate_principal(username: str):
+    # Called whenever a cached user changes: account deletion, profile picture
+    principal_cache.invalidate(username)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
+def principal_claims(user) -> dict:
+    # Extra JWT claims letting get_current_user skip the database, empty unless JWT_PRINCIPAL_CLAIMS is on
+    if not JWT_PRINCIPAL_CLAIMS:
+        return {}
+    return {"uid": user.id, "pic": user.profile.profile_picture}
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+
+async def get_password_hash(password):
+    return await hash_password(password)
+
+
+async def verify_password(plain_password, hashed_password):
+    valid, _ = await verify_and_update(plain_password, hashed_password)
+    return valid
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    # User for valid credentials, None otherwise. Hashes made with an older work factor are upgraded in place
+    user = await get_user_by_username(db, username)
+    if not user:
+        return None
+    valid, new_hash = await verify_and_update(password, user.password)
+    if not valid:
+        return None
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+    return user
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -53,34 +110,216 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str, include_deleted: bool = False):
+    # Profile is loaded up front, lazy loads are not allowed on an async session. Accounts pending deletion
+    # keep their username until purged, registration looks them up with include_deleted
+    result = await db.execute(
+        select(User).options(selectinload(User.profile)).where(User.username == username)
+        .execution_options(include_deleted=include_deleted)
+    )
+    return result.scalars().first()
 
 
-def create_user(db: Session, user: UserCreate):
+async def create_user(db: AsyncSession, user: UserCreate):
     # Hash the password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
 
     # Create User instance with hashed password
     db_user = User(username=user.username, password=hashed_password)
     db.add(db_user)
 
-    # Commit once, and refresh db_user to get the user ID
-    db.commit()
-    db.refresh(db_user)
-
     # Create a default Profile instance associated with the new user
-    db_profile = Profile(user_id=db_user.id, profile_picture="media/profile_pics/default.png")
+    db_profile = Profile(user=db_user, profile_picture="media/profile_pics/default.png")
     db.add(db_profile)
 
-    # Final commit to save the profile
-    db.commit()
-    db.refresh(db_profile)
+    # Single commit saves the user together with the profile
+    await db.commit()
 
     return db_user
 
-def delete_user(db: Session, user_id: int):
-    user = db.query(User).filter(User.id == user_id).first()
-    if user:
-        db.delete(user)
-        db.commit()
+async def delete_user(db: AsyncSession, user_id: int):
+    # A fixed handful of statements however many products the seller has: the account and its products are
+    # hidden and leave the facet counts now, app/cleanup.py deletes the rows, search documents and images. The
+    # suggestions reload in the background instead of dropping the seller's product names one by one
+    deleted_at = datetime.now(timezone.utc)
+    await remove_seller_facets(db, user_id)
+    await db.execute(
+        update(Product).where(Product.user_id == user_id, Product.deleted_at.is_(None))
+        .values(deleted_at=deleted_at, version_id=Product.version_id + 1)
+    )
+    username = (await db.execute(
+        update(User).where(User.id == user_id, User.deleted_at.is_(None)).values(deleted_at=deleted_at)
+        .returning(User.username)
+    )).scalar()
+    await db.commit()
+    if username:
+        product_suggestions.expire()
+        invalidate_principal(username)
+        schedule_purge()
+
+
+async def lock_live_user(db: AsyncSession, user_id: int) -> bool:
+    # Whether the account still exists, checked in the writing transaction before rows are added for it. The
+    # shared lock holds off a concurrent delete_user until commit, so the purge never finds products of a user
+    # deleted meanwhile (SQLite has no row locks, its single writer serializes the two)
+    result = await db.execute(select(User.id).where(User.id == user_id).with_for_update(read=True))
+    return result.scalar() is not None
+
+
+def encode_cursor(*values):
+    # Opaque, url-safe cursor holding the sort key of the last row on a page
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) and values else None
+
+
+# Listing orders besides the default: newest first, or best match first when searching. Price orders break ties
+# on id in the same direction, so every order is a walk over one of the (..., price, id) indexes
+SORTS = ("newest", "price_asc", "price_desc")
+
+
+def parse_price(value):
+    # Bound of a price filter, from query text or the API's validated int; blank or malformed input means no bound
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def parse_category(value):
+    # Category filter, from query text or the API's validated int; blank or malformed input means every category
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def filter_products(query, category: str = '', location: str = '', min_price: str = '', max_price: str = ''):
+    # Apply category filter if selected
+    category_id = parse_category(category)
+    if category_id is not None:
+        query = query.where(Product.category_id == category_id)
+
+    # Apply location filter if selected, any spelling of the location matches
+    if location:
+        location_id = select(Location.id).where(Location.key == location_key(location)).scalar_subquery()
+        query = query.where(Product.location_id == location_id)
+
+    # Apply the price range, either end may be open
+    low, high = parse_price(min_price), parse_price(max_price)
+    if low is not None:
+        query = query.where(Product.price >= low)
+    if high is not None:
+        query = query.where(Product.price <= high)
+    return query
+
+
+def products_page_query(db: AsyncSession, q: str = '', category: str = '', location: str = '', cursor: str = '',
+                        limit: int = PAGE_SIZE, min_price: str = '', max_price: str = '', sort: str = ''):
+    # The statement behind get_products_page(), None when `q` has nothing to search for. Rows are the product
+    # followed by the sort key columns the next cursor is made of. benchmarks/plans.py explains it
+    query = filter_products(select(Product), category, location, min_price, max_price)
+    last = decode_cursor(cursor)
+    if sort not in SORTS:
+        sort = "" if q else "newest"
+
+    if q:
+        ranking = search_ranking(db, q)
+        if ranking is None:
+            return None
+        query = query.join(ranking, ranking.c.product_id == Product.id)
+
+    if sort in ("price_asc", "price_desc"):
+        # Products without a price have no place in a price order
+        price = Product.price
+        query = query.where(price.is_not(None)).add_columns(price)
+        if last and len(last) == 2 and all(isinstance(value, int) for value in last):
+            if sort == "price_asc":
+                query = query.where(or_(price > last[0], and_(price == last[0], Product.id > last[1])))
+            else:
+                query = query.where(or_(price < last[0], and_(price == last[0], Product.id < last[1])))
+        if sort == "price_asc":
+            query = query.order_by(price.asc(), Product.id.asc())
+        else:
+            query = query.order_by(price.desc(), Product.id.desc())
+    elif sort == "newest":
+        if last and len(last) == 1 and isinstance(last[0], int):
+            query = query.where(Product.id < last[0])
+        query = query.order_by(Product.id.desc())
+    else:
+        rank = ranking.c.rank
+        query = query.add_columns(rank)
+        if last and len(last) == 2 and isinstance(last[0], (int, float)) and isinstance(last[1], int):
+            query = query.where(or_(rank < last[0], and_(rank == last[0], Product.id < last[1])))
+        # Product id breaks rank ties so the order is stable across pages
+        query = query.order_by(rank.desc(), Product.id.desc())
+
+    # One extra row tells whether another page exists
+    return query.limit(limit + 1)
+
+
+async def get_products_page(db: AsyncSession, q: str = '', category: str = '', location: str = '',
+                            cursor: str = '', limit: int = PAGE_SIZE, min_price: str = '', max_price: str = '',
+                            sort: str = ''):
+    # Page of products plus the cursor of the next page (None on the last one), in one of SORTS or by search
+    # relevance. Keyset pagination: seek past the sort key of the last row instead of OFFSET, so deep pages
+    # cost the same as the first one
+    query = products_page_query(db, q, category, location, cursor, limit, min_price, max_price, sort)
+    if query is None:
+        return [], None
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][1:], rows[-1][0].id)
+    return [row[0] for row in rows], next_cursor
+
+
+async def get_categories(db: AsyncSession):
+    # Plain (id, name) rows so cached values don't hold on to a closed session
+    async def load():
+        return (await db.execute(select(Category.id, Category.name))).all()
+    return await reference_cache.get_or_load("categories", load)
+
+
+async def get_facet_rows(db: AsyncSession):
+    # (category_id, location, count) of every non-empty pair, from the facet summary table
+    async def load():
+        return await load_facet_rows(db)
+    return await reference_cache.get_or_load("facets", load)
+
+
+async def get_locations(db: AsyncSession):
+    # Every location with products, taken from the facet summary instead of a DISTINCT over products
+    return sorted({location for _, location, _ in await get_facet_rows(db) if location})
+
+
+async def get_facet_counts(db: AsyncSession, q: str = '', category: str = '', location: str = '',
+                           min_price: str = '', max_price: str = ''):
+    # (category counts by id, location counts by name) for the dropdowns. The summary table counts every
+    # product, searches and price ranges count their own matches
+    low, high = parse_price(min_price), parse_price(max_price)
+    if q or low is not None or high is not None:
+        rows = await filtered_facet_rows(db, q, low, high)
+    else:
+        rows = await get_facet_rows(db)
+    return fold_facets(rows, parse_category(category), location)
+
+
+def invalidate_reference_data():
+    # Called after product and category writes are committed
+    reference_cache.invalidate()
+
+
+def invalidate_pages(*tags):
+    # Called after a committed write, with the tags of every page that shows what changed
+    page_cache.invalidate_tags(*tags)
@@ -0,0 +1,103 @@
+# app/facets.py
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.locations import location_key
+from app.models import Product, ProductFacet
+from app.search import search_ranking
+
+# Faceted navigation for the home page: product counts per category and per location. The product_facets
+# summary table holds the count of every (category, location) pair; writes adjust it in their own transaction
+# with adjust_facets(). Searches count their matches in one GROUP BY instead. Either way the result is a list of
+# (category_id, location, count) rows, folded into the two dropdowns' counts by fold_facets()
+
+
+def _pair(category_id, location):
+    return category_id or 0, location or ""
+
+
+def _upsert(db: AsyncSession):
+    # INSERT ... ON CONFLICT adding to the counts of existing pairs
+    statement = (pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert)(ProductFacet)
+    return statement.on_conflict_do_update(
+        index_elements=[ProductFacet.category_id, ProductFacet.location],
+        set_={"product_count": ProductFacet.product_count + statement.excluded.product_count},
+    )
+
+
+async def adjust_facets(db: AsyncSession, changes):
+    # changes: (category_id, location, delta) per product added (+1) or removed (-1), applied in one batched
+    # upsert inside the caller's transaction. An edit passes its old pair with -1 and the new one with +1
+    deltas = Counter()
+    for category_id, location, delta in changes:
+        deltas[_pair(category_id, location)] += delta
+    rows = [
+        {"category_id": category_id, "location": location, "product_count": delta}
+        for (category_id, location), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    await db.execute(_upsert(db), rows)
+
+
+async def remove_seller_facets(db: AsyncSession, user_id: int):
+    # Subtract every listed product of a seller with one INSERT ... SELECT, without loading the products
+    category_id, location = func.coalesce(Product.category_id, 0), func.coalesce(Product.location, "")
+    await db.execute(_upsert(db).from_select(
+        ["category_id", "location", "product_count"],
+        select(category_id, location, -func.count())
+        .where(Product.user_id == user_id, Product.deleted_at.is_(None))
+        .group_by(category_id, location),
+    ))
+
+
+async def rebuild_facets(db: AsyncSession):
+    # Recount every pair from products, for data written around the application (benchmarks/seed.py)
+    await db.execute(delete(ProductFacet))
+    category_id, location = func.coalesce(Product.category_id, 0), func.coalesce(Product.location, "")
+    await db.execute(insert(ProductFacet).from_select(
+        ["category_id", "location", "product_count"],
+        select(category_id, location, func.count()).where(Product.deleted_at.is_(None)).group_by(category_id, location),
+    ))
+
+
+async def load_facet_rows(db: AsyncSession):
+    # Plain tuples so cached values don't hold on to a closed session
+    query = select(ProductFacet.category_id, ProductFacet.location, ProductFacet.product_count)
+    return [tuple(row) for row in await db.execute(query.where(ProductFacet.product_count > 0))]
+
+
+async def filtered_facet_rows(db: AsyncSession, q: str = '', low=None, high=None):
+    # The same rows for the products matching `q` and priced within [low, high], in a single aggregate query
+    category_id, location = func.coalesce(Product.category_id, 0), func.coalesce(Product.location, "")
+    query = select(category_id, location, func.count()).group_by(category_id, location)
+    if q:
+        ranking = search_ranking(db, q)
+        if ranking is None:
+            return []
+        query = query.join(ranking, ranking.c.product_id == Product.id)
+    else:
+        query = query.select_from(Product)
+    if low is not None:
+        query = query.where(Product.price >= low)
+    if high is not None:
+        query = query.where(Product.price <= high)
+    return [tuple(row) for row in await db.execute(query)]
+
+
+def fold_facets(rows, selected_category: int = None, location: str = ''):
+    # (category counts by id, location counts by name). Each dropdown counts under the other dropdown's
+    # selection but not its own, so its entries show what picking them instead would list
+    selected_location = location_key(location)
+    category_counts = Counter()
+    location_counts = Counter()
+    for category_id, product_location, count in rows:
+        if not selected_location or location_key(product_location) == selected_location:
+            category_counts[category_id] += count
+        if selected_category is None or category_id == selected_category:
+            location_counts[product_location] += count
+    return category_counts, location_counts
@@ -0,0 +1,91 @@
+# app/index_check.py
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import UniqueConstraint, inspect
+
+from app.database import Base, engine
+import app.models  # noqa: F401, registers the tables on Base.metadata
+
+# Every WHERE / ORDER BY shape the application runs against its tables: the equality columns (any order)
+# and the sort columns that must follow them in an index. New queries get an entry here, and
+# `python -m app.index_check` fails while any pattern has no index, primary key or unique constraint serving it.
+# --live checks the indexes of the database in DATABASE_URL instead of the models, catching missing migrations
+
+QUERY_PATTERNS = (
+    ("home, newest first", "products", (), ("id",)),
+    ("home, category filter", "products", ("category_id",), ("id",)),
+    ("home, location filter", "products", ("location_id",), ("id",)),
+    ("home, category and location filter", "products", ("category_id", "location_id"), ("id",)),
+    ("home by price", "products", (), ("price", "id")),
+    ("home by price, category filter", "products", ("category_id",), ("price", "id")),
+    ("home by price, location filter", "products", ("location_id",), ("price", "id")),
+    ("home by price, category and location filter", "products", ("category_id", "location_id"), ("price", "id")),
+    ("seller listing and ownership checks", "products", ("user_id",), ()),
+    ("product detail", "products", ("id",), ()),
+    ("login and current user", "users", ("username",), ()),
+    ("profile of a user", "profiles", ("user_id",), ()),
+    ("category by name", "categories", ("name",), ()),
+    ("location by normalized name", "locations", ("key",), ()),
+    ("media reference counts", "media_files", ("path",), ()),
+    ("facet count upserts", "product_facets", ("category_id", "location"), ()),
+)
+
+
+def model_indexes() -> dict:
+    # Table name -> [(index name, column names)] declared on the models
+    indexes = {}
+    for table in Base.metadata.tables.values():
+        entries = indexes.setdefault(table.name, [])
+        entries.append(("primary key", [column.name for column in table.primary_key.columns]))
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                entries.append((constraint.name or "unique", [column.name for column in constraint.columns]))
+        for index in table.indexes:
+            entries.append((index.name, [column.name for column in index.columns]))
+    return indexes
+
+
+def live_indexes(sync_conn) -> dict:
+    inspector = inspect(sync_conn)
+    indexes = {}
+    for table in inspector.get_table_names():
+        entries = indexes.setdefault(table, [])
+        entries.append(("primary key", inspector.get_pk_constraint(table)["constrained_columns"]))
+        for constraint in inspector.get_unique_constraints(table):
+            entries.append((constraint["name"] or "unique", constraint["column_names"]))
+        for index in inspector.get_indexes(table):
+            entries.append((index["name"], index["column_names"]))
+    return indexes
+
+
+def supports(columns, equality, order) -> bool:
+    # Equality columns first, in any order, then the sort columns in order
+    count = len(equality)
+    return set(columns[:count]) == set(equality) and list(columns[count:count + len(order)]) == list(order)
+
+
+def check(indexes: dict) -> bool:
+    ok = True
+    for description, table, equality, order in QUERY_PATTERNS:
+        match = next((name for name, columns in indexes.get(table, []) if supports(columns, equality, order)), None)
+        shape = ", ".join(list(equality) + [f"order by {column}" for column in order])
+        print(f"{'ok' if match else 'MISSING':8} {table}({shape}) - {description}: {match or 'no supporting index'}")
+        ok = ok and match is not None
+    return ok
+
+
+async def load_live_indexes() -> dict:
+    async with engine.connect() as conn:
+        indexes = await conn.run_sync(live_indexes)
+    await engine.dispose()
+    return indexes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every query pattern has a supporting index")
+    parser.add_argument("--live", action="store_true", help="inspect the database in DATABASE_URL instead of the models")
+    args = parser.parse_args()
+    indexes = asyncio.run(load_live_indexes()) if args.live else model_indexes()
+    sys.exit(0 if check(indexes) else 1)
@@ -1,15 +1,47 @@
- 
+
 # app/init_db.py
 
 import asyncio
 
-from app.database import engine
-from app.models import Base
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+
+from app.database import engine, SessionLocal
+from app.models import MediaFile
+from app.search import create_search_index, rebuild_search_index
+
+# Schema changes are Alembic migrations (alembic/versions); this brings any database to the latest one.
+# Databases created by create_all() before migrations existed are stamped with the baseline revision first
+
+BASELINE_REVISION = "5c031498a41f"
 
 
-async def init_db():
+async def adopt_unversioned_schema() -> bool:
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        tables = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+        unversioned = "products" in tables and "alembic_version" not in tables
+        if unversioned:
+            # Tables the baseline has but the oldest create_all() databases lack
+            await conn.run_sync(MediaFile.__table__.create, checkfirst=True)
+            await create_search_index(conn)
+    await engine.dispose()
+    return unversioned
+
+
+async def rebuild_index():
+    # Index products that were created before the search index existed
+    async with SessionLocal() as db:
+        await rebuild_search_index(db)
+    await engine.dispose()
+
+
+def init_db():
+    config = Config("alembic.ini")
+    if asyncio.run(adopt_unversioned_schema()):
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, "head")
+    asyncio.run(rebuild_index())
 
 if __name__ == "__main__":
-    asyncio.run(init_db())
+    init_db()
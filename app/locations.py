@@ -0,0 +1,129 @@
+# app/locations.py
+import bisect
+import time
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Location
+from config import LOCATION_INDEX_TTL
+
+# Product locations are free text from the seller. They are normalized into the locations table so "Berlin",
+# "berlin " and "Berlin, DE" are one place: one filter value, one facet, one dropdown entry. Everything after
+# the first comma is treated as a region or country suffix and dropped. The LocationIndex below keeps every
+# location in sorted arrays for /locations/suggest
+
+
+def clean_location(text: str) -> str:
+    # Display form: the part before the first comma, whitespace collapsed
+    return " ".join((text or "").split(",")[0].split())[:50]
+
+
+def location_key(text: str) -> str:
+    return clean_location(text).casefold()[:50]
+
+
+class LocationIndex:
+    # Prefix search over location names in memory. Keys sit in a sorted array, so a prefix is one bisect plus
+    # a scan over the matches; a second array of word suffixes ("york" -> "new york") finds later words.
+    # Built from the table on startup, extended by add() as this process creates locations, and reloaded
+    # every LOCATION_INDEX_TTL seconds for the ones other processes created
+
+    def __init__(self):
+        self._names = {}  # key -> (id, name)
+        self._keys = []
+        self._words = []  # sorted (suffix starting at a word, key)
+        self.loaded_at = None
+
+    @staticmethod
+    def _word_suffixes(key: str):
+        return [(key[index + 1:], key) for index, char in enumerate(key) if char == " " and key[index + 1:]]
+
+    def add(self, location_id: int, name: str, key: str):
+        if key in self._names:
+            return
+        self._names[key] = (location_id, name)
+        bisect.insort(self._keys, key)
+        for entry in self._word_suffixes(key):
+            bisect.insort(self._words, entry)
+
+    def get(self, key: str):
+        return self._names.get(key)
+
+    async def load(self, db: AsyncSession):
+        rows = (await db.execute(select(Location.id, Location.name, Location.key))).all()
+        names = {key: (location_id, name) for location_id, name, key in rows}
+        # Swapped in whole, suggest() never sees a half built index
+        self._names, self._keys = names, sorted(names)
+        self._words = sorted(entry for key in names for entry in self._word_suffixes(key))
+        self.loaded_at = time.monotonic()
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > LOCATION_INDEX_TTL:
+            await self.load(db)
+
+    def suggest(self, prefix: str, limit: int):
+        # Names starting with `prefix`, then names with a later word starting with it, alphabetically
+        prefix = location_key(prefix)
+        if not prefix:
+            return []
+        matches = []
+        index = bisect.bisect_left(self._keys, prefix)
+        while index < len(self._keys) and len(matches) < limit and self._keys[index].startswith(prefix):
+            matches.append(self._keys[index])
+            index += 1
+        index = bisect.bisect_left(self._words, (prefix,))
+        while index < len(self._words) and len(matches) < limit and self._words[index][0].startswith(prefix):
+            if self._words[index][1] not in matches:
+                matches.append(self._words[index][1])
+            index += 1
+        return [self._names[key][1] for key in matches]
+
+
+location_index = LocationIndex()
+
+
+async def resolve_locations(db: AsyncSession, texts) -> dict:
+    # Seller input -> (location id, canonical name) for a batch, creating the locations that don't exist yet
+    # with one INSERT and reading them all back with one SELECT. Blank input maps to (None, "")
+    resolved = {}
+    missing = {}
+    for text in texts:
+        key = location_key(text)
+        if key:
+            missing.setdefault(key, []).append(text)
+        else:
+            resolved[text] = (None, "")
+    if not missing:
+        return resolved
+
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    await db.execute(
+        insert(Location).on_conflict_do_nothing(index_elements=[Location.key]),
+        [{"key": key, "name": clean_location(spellings[0])} for key, spellings in missing.items()],
+    )
+    rows = await db.execute(select(Location.id, Location.name, Location.key).where(Location.key.in_(missing)))
+    for location_id, name, key in rows:
+        for text in missing[key]:
+            resolved[text] = (location_id, name)
+    return resolved
+
+
+async def resolve_location(db: AsyncSession, text: str):
+    # One location for a product write, from the index when it knows the place. A new location is inserted in
+    # the caller's transaction, it commits or rolls back with the product; remember_location() after the commit
+    key = location_key(text)
+    if not key:
+        return None, ""
+    known = location_index.get(key)
+    if known:
+        return known
+    return (await resolve_locations(db, [text]))[text]
+
+
+def remember_location(location_id: int, name: str):
+    # Called once the write using the location has committed, so the index never serves an id that was rolled back
+    if location_id is not None:
+        location_index.add(location_id, name, location_key(name))
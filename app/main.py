@@ -1,19 +1,86 @@
 # app/main.py
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 
+from app.assets import AssetStaticFiles, url_for
+from app.cleanup import start_worker, stop_worker
+from app.compression import CompressionMiddleware
+from app.database import ReadAfterWriteMiddleware, ReadSessionLocal, engine, engines, read_engine
+from app.locations import location_index
+from app.media import UploadLimitMiddleware
+from app.metrics import MetricsMiddleware, instrument_templates
+from app.query_budget import QueryBudgetMiddleware
+from app.routers.api import router as api_router
 from app.routers.auth import router as auth_router
 from app.routers.main_routes import router as main_router
 from app.routers.product import router as product_router
 from app.routers.profile import router as profile_router
+from app.streaming import stream_flush
+from app.thumbnails import image_srcset
+from app.warmup import warm_up
+from config import MAX_UPLOAD_SIZE, templates
+
+
+def configure_templates():
+    # Sets up the shared environment of config.py, before the first template is loaded; repeating it is harmless.
+    # Time every template render for /metrics
+    instrument_templates(templates)
+    # Template helpers: resized copies of uploaded images, fingerprinted static asset urls, streaming flush points
+    templates.env.globals["image_srcset"] = image_srcset
+    templates.env.globals["url_for"] = url_for
+    templates.env.globals["stream_flush"] = stream_flush
+
+
+def create_app(warmup: bool = True) -> FastAPI:
+    # warmup=False skips app/warmup.py, for scripts and tests that don't care about the first request's latency
+    configure_templates()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if warmup:
+            await warm_up()
+        else:
+            # Location autocomplete answers from memory, build its index before the first request
+            async with ReadSessionLocal() as db:
+                await location_index.load(db)
+        # Background purge of deleted products and accounts, and the periodic media sweep
+        start_worker()
+        yield
+        await stop_worker()
+        # Close pooled connections now instead of leaving them to the database to time out
+        for target in set(engines.values()):
+            await target.dispose()
+
+    app = FastAPI(lifespan=lifespan)
+
+    # Cut oversized uploads off while they stream in, leaving room for the other form fields
+    app.add_middleware(UploadLimitMiddleware, max_body_size=MAX_UPLOAD_SIZE + 64 * 1024)
+
+    # Report requests running more SQL than their route's budget
+    app.add_middleware(QueryBudgetMiddleware)
+
+    # With a read replica, clients read their own writes from the primary for a few seconds
+    if read_engine is not engine:
+        app.add_middleware(ReadAfterWriteMiddleware)
+
+    # Brotli/gzip for dynamic responses, streamed ones included
+    app.add_middleware(CompressionMiddleware)
+
+    # Outermost, so the latency it records covers every other middleware
+    app.add_middleware(MetricsMiddleware)
+
+    # Mount static files, fingerprinted and precompressed once `python -m app.assets` has run
+    app.mount("/static", AssetStaticFiles(directory="app/static"), name="static")
 
-app = FastAPI()
+    # Include routers
+    app.include_router(auth_router, prefix="/auth", tags=["auth"])
+    app.include_router(product_router, prefix="/products", tags=["products"])
+    app.include_router(profile_router, prefix="/profile", tags=["profile"])
+    app.include_router(api_router, prefix="/api/v1", tags=["api"])
+    app.include_router(main_router, prefix="", tags=["main"])
+    return app
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-# Include routers
-app.include_router(auth_router, prefix="/auth", tags=["auth"])
-app.include_router(product_router, prefix="/products", tags=["products"])
-app.include_router(profile_router, prefix="/profile", tags=["profile"])
-app.include_router(main_router, prefix="", tags=["main"])
+# uvicorn app.main:app
+app = create_app()
@@ -0,0 +1,275 @@
+# app/media.py
+import glob
+import hashlib
+import os
+import uuid
+from collections import Counter
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from app.cache import LRUCache
+from app.models import MediaFile
+from config import MAX_UPLOAD_SIZE, IMAGE_DERIVATIVE_CACHE_SIZE, IMAGE_DERIVATIVE_CACHE_TTL
+
+STATIC_DIR = "app/static"
+PRODUCT_IMAGES = "media/product_images"
+PROFILE_PICS = "media/profile_pics"
+
+# Resized copies of uploads, generated by app/thumbnails.py
+DERIVATIVES = "media/derivatives"
+
+# Source path -> widths with finished derivatives, the only thing rendering looks at. Filled by app/thumbnails.py
+# from what it generates and from media_files.derivative_widths, dropped here together with the files
+ready_derivatives = LRUCache("derivatives", ttl=IMAGE_DERIVATIVE_CACHE_TTL, maxsize=IMAGE_DERIVATIVE_CACHE_SIZE)
+
+
+def format_widths(widths) -> str:
+    # media_files.derivative_widths column value, "" for an image too small for any width
+    return ",".join(map(str, widths))
+
+
+def parse_widths(text: str) -> list:
+    return [int(width) for width in text.split(",") if width]
+
+
+DEFAULT_PRODUCT_IMAGE = f"{PRODUCT_IMAGES}/default_product.png"
+DEFAULT_PROFILE_PICTURE = f"{PROFILE_PICS}/default.png"
+DEFAULT_IMAGES = {DEFAULT_PRODUCT_IMAGE, DEFAULT_PROFILE_PICTURE}
+
+CHUNK_SIZE = 64 * 1024
+
+# Accepted image types, recognised from their leading bytes rather than the client's content type
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+)
+
+
+def _sniff(header: bytes):
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type, extension
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    return None
+
+
+def _insert(db: AsyncSession):
+    return pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+
+
+async def save_upload(db: AsyncSession, upload: UploadFile, directory: str) -> str:
+    # Store an uploaded image under `directory` and return its path relative to app/static.
+    # The file is copied in chunks off the event loop while being hashed, and named after its SHA-256
+    # so identical uploads share one file. Each call adds a reference, dropped again with release()
+    target_dir = os.path.join(STATIC_DIR, directory)
+    await run_in_threadpool(os.makedirs, target_dir, exist_ok=True)
+    temp_path = os.path.join(target_dir, f".upload-{uuid.uuid4().hex}.tmp")
+
+    digest = hashlib.sha256()
+    size = 0
+    sniffed = None
+    buffer = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while chunk := await upload.read(CHUNK_SIZE):
+            if sniffed is None:
+                sniffed = _sniff(chunk)
+                if sniffed is None:
+                    raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF and WebP images are accepted")
+            size += len(chunk)
+            if size > MAX_UPLOAD_SIZE:
+                raise HTTPException(status_code=413, detail="Image is too large")
+            digest.update(chunk)
+            await run_in_threadpool(buffer.write, chunk)
+        await run_in_threadpool(buffer.close)
+        if sniffed is None:
+            raise HTTPException(status_code=415, detail="Uploaded file is empty")
+
+        content_type, extension = sniffed
+        path = f"{directory}/{digest.hexdigest()}{extension}"
+        # Same bytes, same name: replacing an existing copy is harmless and keeps this atomic
+        await run_in_threadpool(os.replace, temp_path, os.path.join(STATIC_DIR, path))
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(_unlink, temp_path)
+        raise
+
+    insert = _insert(db)
+    widths = (await db.execute(
+        insert(MediaFile)
+        .values(path=path, sha256=digest.hexdigest(), size=size, content_type=content_type, ref_count=1)
+        .on_conflict_do_update(index_elements=[MediaFile.path], set_={"ref_count": MediaFile.ref_count + 1})
+        .returning(MediaFile.derivative_widths)
+    )).scalar()
+    # The row knows whether the copies exist; another process may have deleted and this one still remember them
+    if widths is None:
+        ready_derivatives.invalidate(path)
+    else:
+        ready_derivatives.set(path, parse_widths(widths))
+    return path
+
+
+def store_file(source: str, directory: str):
+    # Blocking counterpart of save_upload for files already on disk, used by the bulk import: copies `source`
+    # under `directory`, named after its SHA-256, and returns (path, sha256, size, content_type) for
+    # add_references(). Raises ValueError for files save_upload would reject
+    with open(source, "rb") as f:
+        sniffed = _sniff(f.read(16))
+        if sniffed is None:
+            raise ValueError(f"{source} is not a JPEG, PNG, GIF or WebP image")
+        f.seek(0)
+
+        target_dir = os.path.join(STATIC_DIR, directory)
+        os.makedirs(target_dir, exist_ok=True)
+        temp_path = os.path.join(target_dir, f".upload-{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, "wb") as buffer:
+                while chunk := f.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_SIZE:
+                        raise ValueError(f"{source} is larger than {MAX_UPLOAD_SIZE} bytes")
+                    digest.update(chunk)
+                    buffer.write(chunk)
+            content_type, extension = sniffed
+            path = f"{directory}/{digest.hexdigest()}{extension}"
+            os.replace(temp_path, os.path.join(STATIC_DIR, path))
+        except BaseException:
+            _unlink(temp_path)
+            raise
+    return path, digest.hexdigest(), size, content_type
+
+
+async def add_references(db: AsyncSession, files):
+    # One reference per (path, sha256, size, content_type) in `files`, in a single batched upsert
+    counts = {}
+    for path, sha256, size, content_type in files:
+        row = counts.setdefault(path, {
+            "path": path, "sha256": sha256, "size": size, "content_type": content_type, "ref_count": 0,
+        })
+        row["ref_count"] += 1
+    if not counts:
+        return
+    statement = _insert(db)(MediaFile)
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[MediaFile.path], set_={"ref_count": MediaFile.ref_count + statement.excluded.ref_count}
+        ),
+        list(counts.values()),
+    )
+
+
+async def release(db: AsyncSession, path: str):
+    # Drop one reference to `path` inside the caller's transaction. Returns the files that are no longer
+    # referenced, to be passed to delete_files() once the transaction has committed
+    if not path or path in DEFAULT_IMAGES:
+        return []
+    result = await db.execute(
+        update(MediaFile)
+        .where(MediaFile.path == path)
+        .values(ref_count=MediaFile.ref_count - 1)
+        .returning(MediaFile.ref_count)
+    )
+    remaining = result.scalar()
+    if remaining is None:
+        # Uploaded before files were content-addressed, only ever referenced by one row
+        return [path]
+    if remaining > 0:
+        return []
+    await db.execute(delete(MediaFile).where(MediaFile.path == path, MediaFile.ref_count <= 0))
+    return [path]
+
+
+async def release_many(db: AsyncSession, paths) -> list:
+    # release() for a batch of paths, one reference per occurrence, in one executemany UPDATE
+    counts = Counter(path for path in paths if path and path not in DEFAULT_IMAGES)
+    if not counts:
+        return []
+    known = set(await db.scalars(select(MediaFile.path).where(MediaFile.path.in_(counts))))
+    media = MediaFile.__table__
+    if known:
+        await db.execute(
+            update(media)
+            .where(media.c.path == bindparam("released_path"))
+            .values(ref_count=media.c.ref_count - bindparam("released")),
+            [{"released_path": path, "released": counts[path]} for path in known],
+        )
+    unreferenced = list(await db.scalars(
+        select(MediaFile.path).where(MediaFile.path.in_(known), MediaFile.ref_count <= 0)
+    )) if known else []
+    if unreferenced:
+        await db.execute(delete(MediaFile).where(MediaFile.path.in_(unreferenced)))
+    # Paths without a row predate content addressing and had a single reference, as in release()
+    return unreferenced + [path for path in counts if path not in known]
+
+
+def _unlink(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def derivative_path(path: str, width: int, extension: str) -> str:
+    # media/product_images/<name>.png -> media/derivatives/product_images/<name>_<width>.<extension>
+    directory, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    return f"{DERIVATIVES}/{os.path.basename(directory)}/{stem}_{width}.{extension}"
+
+
+def _delete_with_derivatives(path: str):
+    _unlink(os.path.join(STATIC_DIR, path))
+    pattern = derivative_path(glob.escape(path), "*", "*")
+    for derivative in glob.glob(os.path.join(STATIC_DIR, pattern)):
+        _unlink(derivative)
+
+
+async def delete_files(paths):
+    for path in paths:
+        # Forgotten first, a page rendered meanwhile must not point at copies that are going away
+        ready_derivatives.invalidate(path)
+        await run_in_threadpool(_delete_with_derivatives, path)
+
+
+class UploadLimitMiddleware:
+    # Rejects multipart bodies larger than `max_body_size` with a 413 before they are spooled:
+    # up front from Content-Length, or as soon as the streamed bytes go over the limit
+
+    def __init__(self, app, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": "Upload is too large"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Surfaces from form parsing as a regular 413 response
+                    raise HTTPException(status_code=413, detail="Upload is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
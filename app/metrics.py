@@ -0,0 +1,256 @@
+# app/metrics.py
+import logging
+import time
+from contextvars import ContextVar
+
+from jinja2 import Template
+from sqlalchemy import event
+
+from app.cache import cache_stats
+from app.database import database_stats, engines, pool_stats
+from app.passwords import stats as password_counters
+from app.suggestions import product_suggestions
+from app.warmup import startup_seconds
+from config import SLOW_REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Request latency per route, SQL time per statement, template render time, plus the pool, cache, password
+# hashing and suggestion index counters and the startup warmup phases, rendered in the Prometheus text format for
+# /metrics. Requests slower than SLOW_REQUEST_SECONDS are logged with the SQL they ran.
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        # Label values -> [count per bucket..., count above the last bucket, sum]
+        self.series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (bound,))} {cumulative}"
+            cumulative += series[len(self.buckets)]
+            yield f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+request_duration = Histogram(
+    "handme_http_request_duration_seconds", "Request latency by route", ("method", "route", "status"),
+)
+sql_duration = Histogram("handme_sql_statement_duration_seconds", "SQL statement time by operation", ("operation",))
+template_duration = Histogram("handme_template_render_duration_seconds", "Jinja2 render time", ("template",))
+
+
+class _RequestRecord:
+    def __init__(self):
+        self.statements = []
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+# What the current request spent in SQL and templates, None outside of one
+_request = ContextVar("request_metrics", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    sql_duration.observe(elapsed, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+    record = _request.get()
+    if record is not None:
+        record.sql_seconds += elapsed
+        record.statements.append((statement, elapsed))
+
+
+for _engine in set(engines.values()):
+    event.listen(_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class TimedTemplate(Template):
+    # Template class of the app's Jinja2 environment, see instrument_templates(). Streamed renders count
+    # the whole stream, including the queries the template awaits
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            _record_render(self.name, time.perf_counter() - started)
+
+    async def render_async(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().render_async(*args, **kwargs)
+        finally:
+            _record_render(self.name, time.perf_counter() - started)
+
+    async def generate_async(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            async for piece in super().generate_async(*args, **kwargs):
+                yield piece
+        finally:
+            _record_render(self.name, time.perf_counter() - started)
+
+
+def _record_render(name: str, elapsed: float):
+    template_duration.observe(elapsed, name or "<string>")
+    record = _request.get()
+    if record is not None:
+        record.template_seconds += elapsed
+
+
+def instrument_templates(templates):
+    # Has to run before the first template is loaded, cached templates keep their class
+    templates.env.template_class = TimedTemplate
+
+
+class MetricsMiddleware:
+    # Outermost middleware: times every request under its route template and logs slow ones
+
+    def __init__(self, app, slow_request_seconds=SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        record = _RequestRecord()
+        token = _request.set(record)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request.reset(token)
+            # Route templates keep the label set small; mounts (static files) are labelled by their prefix
+            route = scope.get("route")
+            path = route.path if route is not None else scope.get("root_path") or "unmatched"
+            request_duration.observe(elapsed, scope["method"], path, str(status))
+            if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+                self._log_slow(scope, status, elapsed, record)
+
+    def _log_slow(self, scope, status, elapsed, record):
+        statements = "".join(
+            f"\n  {seconds * 1000:8.2f} ms  {' '.join(statement.split())[:300]}" for statement, seconds in record.statements
+        )
+        logger.warning(
+            "Slow request %s %s -> %s: %.1f ms total, %.1f ms SQL in %d statements, %.1f ms templates%s",
+            scope["method"], scope["path"], status, elapsed * 1000, record.sql_seconds * 1000,
+            len(record.statements), record.template_seconds * 1000, statements,
+        )
+
+
+def _gauge(name: str, description: str, samples, kind: str = "gauge"):
+    # samples: [(label names, label values, value)], None values are left out
+    yield f"# HELP {name} {description}"
+    yield f"# TYPE {name} {kind}"
+    for names, values, value in samples:
+        if value is not None:
+            yield f"{name}{_labels(names, values)} {value}"
+
+
+def _collect_pools():
+    pools = database_stats()
+    for key, name, description, kind in (
+        ("checked_out", "handme_db_pool_checked_out", "Connections currently checked out", "gauge"),
+        ("pool_size", "handme_db_pool_size", "Configured persistent connections", "gauge"),
+        ("overflow", "handme_db_pool_overflow", "Connections above the pool size", "gauge"),
+        ("checkouts", "handme_db_pool_checkouts_total", "Connection checkouts", "counter"),
+        ("timeouts", "handme_db_pool_timeouts_total", "Checkouts that timed out", "counter"),
+    ):
+        yield from _gauge(name, description, [(("engine",), (engine,), stats[key]) for engine, stats in pools.items()],
+                          kind)
+    yield from _gauge(
+        "handme_db_pool_wait_seconds_total", "Time spent waiting for a connection",
+        [(("engine",), (engine,), pool_stats[engine].wait_seconds) for engine in pools], "counter",
+    )
+
+
+def _collect_caches():
+    caches = cache_stats()
+    for key, name, description, kind in (
+        ("hits", "handme_cache_hits_total", "Cache hits", "counter"),
+        ("misses", "handme_cache_misses_total", "Cache misses", "counter"),
+        ("size", "handme_cache_entries", "Entries currently cached", "gauge"),
+    ):
+        yield from _gauge(name, description, [(("cache",), (cache,), stats[key]) for cache, stats in caches.items()], kind)
+
+
+def _collect_passwords():
+    stats = password_counters
+    yield from _gauge("handme_password_hash_queue_depth", "bcrypt calls queued or running", [((), (), stats.pending)])
+    for name, description, value in (
+        ("handme_password_hash_rejected_total", "bcrypt calls shed with a 503", stats.rejected),
+        ("handme_password_hash_total", "bcrypt hash and verify calls", stats.count),
+        ("handme_password_hash_seconds_total", "Time spent in bcrypt", stats.hash_seconds),
+        ("handme_password_hash_wait_seconds_total", "Time bcrypt calls waited for a worker", stats.wait_seconds),
+    ):
+        yield from _gauge(name, description, [((), (), value)], "counter")
+
+
+def _collect_startup():
+    yield from _gauge(
+        "handme_startup_phase_seconds", "Time each warmup phase took when this worker started",
+        [(("phase",), (phase,), seconds) for phase, seconds in startup_seconds.items()],
+    )
+
+
+def _collect_suggestions():
+    stats = product_suggestions.stats()
+    yield from _gauge("handme_suggest_names", "Product names in the suggestion index", [((), (), stats["names"])])
+    yield from _gauge("handme_suggest_bytes", "Estimated memory held by the suggestion index",
+                      [((), (), stats["bytes"])])
+    yield from _gauge("handme_suggest_dropped", "Product names left out of the full suggestion index",
+                      [((), (), stats["dropped"])])
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in (request_duration, sql_duration, template_duration):
+        lines.extend(histogram.render())
+    for collect in (_collect_pools, _collect_caches, _collect_passwords, _collect_suggestions, _collect_startup):
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
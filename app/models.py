@@ -1,22 +1,47 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, Index, event, func, text
+from sqlalchemy.orm import Session, relationship, with_loader_criteria
 
 from .database import Base
 
+# Relationships never load lazily: anything a route or template reads has to come from an explicit
+# selectinload()/joinedload(), otherwise the access raises instead of quietly running one query per row
+NO_LAZY = "raise_on_sql"
 
-class User(Base):
+
+# Predicates of partial indexes over soft-deleted and live rows
+DELETED = text("deleted_at IS NOT NULL")
+LIVE = text("deleted_at IS NULL")
+
+
+class SoftDelete:
+    # Deleting sets deleted_at; app/cleanup.py removes the rows later in the background
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _hide_deleted(state):
+    # Soft-deleted rows are invisible to every ORM query, relationship loads included. The purge and the
+    # username check opt out with execution_options(include_deleted=True)
+    if state.is_select and not state.is_column_load and not state.is_relationship_load \
+            and not state.execution_options.get("include_deleted", False):
+        state.statement = state.statement.options(
+            with_loader_criteria(SoftDelete, lambda cls: cls.deleted_at.is_(None), include_aliases=True)
+        )
+
+
+class User(SoftDelete, Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False)
     password = Column(String, nullable=False)
 
     # Relationship to Profile
-    profile = relationship('Profile', back_populates='user', cascade='all, delete-orphan', uselist=False)
+    profile = relationship('Profile', back_populates='user', cascade='all, delete-orphan', uselist=False, lazy=NO_LAZY)
 
     # Relationship to Products
-    products = relationship('Product', back_populates='creator', cascade='all, delete-orphan')  # One-to-many relationship
+    products = relationship('Product', back_populates='creator', cascade='all, delete-orphan', lazy=NO_LAZY)  # One-to-many relationship
 
 
 class Profile(Base):
@@ -26,30 +51,89 @@ class Profile(Base):
     profile_picture = Column(String, nullable=True, default="media/profile_pics/default.png")
     location = Column(String(100), nullable=True)
     bio = Column(Text, nullable=True)
+    # Bumped by the ORM on every UPDATE, the pages' ETags are built from it (app/conditional.py)
+    version_id = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version_id}
 
-    user = relationship("User", back_populates="profile")
+    user = relationship("User", back_populates="profile", lazy=NO_LAZY)
 
 
 class Category(Base):
     __tablename__ = "categories"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(50), unique=True, nullable=False)
+    version_id = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version_id}
 
     # Relationship to Products
-    products = relationship('Product', back_populates='category', cascade='all, delete-orphan')  # One-to-many relationship with Product
+    products = relationship('Product', back_populates='category', cascade='all, delete-orphan', lazy=NO_LAZY)  # One-to-many relationship with Product
 
 
-class Product(Base):
+class Location(Base):
+    # One row per place however sellers spell it, see app/locations.py. Rows are never renamed or deleted
+    __tablename__ = "locations"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)  # first spelling seen, e.g. "Berlin"
+    key = Column(String(50), unique=True, nullable=False)  # normalized, e.g. "berlin"
+
+
+class Product(SoftDelete, Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # home() filters by category, location or both, newest first; the category index also serves category_id
+        # as a foreign key. Schema changes go through alembic/, app/index_check.py checks the coverage
+        Index("ix_products_category", "category_id", "id"),
+        Index("ix_products_location", "location_id", "id"),
+        Index("ix_products_category_location", "category_id", "location_id", "id"),
+        # The same filters ordered by price, id breaking ties; they also serve price ranges. The unfiltered one
+        # only holds live products and carries the facet columns, the price range facet counts mostly read the index
+        Index("ix_products_price", "price", "id", "category_id", "location", sqlite_where=LIVE, postgresql_where=LIVE),
+        Index("ix_products_category_price", "category_id", "price", "id"),
+        Index("ix_products_location_price", "location_id", "price", "id"),
+        Index("ix_products_category_location_price", "category_id", "location_id", "price", "id"),
+        # The background purge looks for soft-deleted products. Partial, so it only holds those rows and the
+        # planner never walks it for the deleted_at IS NULL every listing carries
+        Index("ix_products_deleted_at", "deleted_at", sqlite_where=DELETED, postgresql_where=DELETED),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     description = Column(Text)
     price = Column(Integer)
     image = Column(String, nullable=True, default="media/product_images/default_product.png")
+    # Canonical name of the location, copied from Location.name for rendering and search; filters use location_id
     location = Column(String(50))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    location_id = Column(Integer, ForeignKey("locations.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     category_id = Column(Integer, ForeignKey("categories.id"))
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+    version_id = Column(Integer, nullable=False, server_default="1")
+    # created_at comes from the database, read back on insert so it is never lazily loaded. version_id is bumped
+    # by the ORM on every UPDATE, as for Profile and Category
+    __mapper_args__ = {"eager_defaults": True, "version_id_col": version_id}
 
     # Relationships
-    creator = relationship("User", back_populates="products")  # Relationship to User
-    category = relationship("Category", back_populates="products")  # Relationship to Category
+    creator = relationship("User", back_populates="products", lazy=NO_LAZY)  # Relationship to User
+    category = relationship("Category", back_populates="products", lazy=NO_LAZY)  # Relationship to Category
+
+
+class MediaFile(Base):
+    # Content-addressed upload under app/static, shared by every row that references the same bytes
+    __tablename__ = "media_files"
+    path = Column(String, primary_key=True)  # relative to app/static, e.g. media/product_images/<sha256>.png
+    sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String(50), nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    # Widths of its finished resized copies ("160,320,640", "" for an image narrower than all of them), NULL
+    # until app/thumbnails.py has written them
+    derivative_widths = Column(String(50), nullable=True)
+
+
+class ProductFacet(Base):
+    # Number of products per (category, location) pair, the unfiltered facet counts of the home page.
+    # Kept current by the product write paths through app/facets.py instead of counting over products
+    # on every page view. A missing category or location is stored as 0 / "" so the pair can be the key
+    __tablename__ = "product_facets"
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    location = Column(String(50), primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
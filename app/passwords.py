@@ -0,0 +1,81 @@
+# app/passwords.py
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+
+# Changing BCRYPT_ROUNDS marks older hashes as needing an update, they are rehashed on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+class _Stats:
+    def __init__(self):
+        self.pending = 0
+        self.max_pending = 0
+        self.rejected = 0
+        self.count = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_hash_seconds = 0.0
+
+
+stats = _Stats()
+
+
+async def _run(fn, *args):
+    # Admission control: once PASSWORD_HASH_MAX_PENDING calls are queued or running, shed load
+    # instead of letting a login burst pile up behind the pool
+    if stats.pending >= PASSWORD_HASH_MAX_PENDING:
+        stats.rejected += 1
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+    stats.pending += 1
+    stats.max_pending = max(stats.max_pending, stats.pending)
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        result = fn(*args)
+        return result, started, time.perf_counter()
+
+    try:
+        result, started, finished = await asyncio.get_running_loop().run_in_executor(_executor, timed)
+    finally:
+        stats.pending -= 1
+
+    stats.count += 1
+    stats.wait_seconds += started - submitted
+    stats.hash_seconds += finished - started
+    stats.max_hash_seconds = max(stats.max_hash_seconds, finished - started)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_and_update(password: str, hashed: str):
+    # (valid, new_hash): new_hash is set when the stored hash uses outdated settings
+    return await _run(pwd_context.verify_and_update, password, hashed)
+
+
+def password_stats() -> dict:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "queue_depth": stats.pending,
+        "max_queue_depth": stats.max_pending,
+        "queue_limit": PASSWORD_HASH_MAX_PENDING,
+        "rejected": stats.rejected,
+        "count": stats.count,
+        "avg_wait_ms": round(stats.wait_seconds / stats.count * 1000, 3) if stats.count else None,
+        "avg_hash_ms": round(stats.hash_seconds / stats.count * 1000, 3) if stats.count else None,
+        "max_hash_ms": round(stats.max_hash_seconds * 1000, 3),
+    }
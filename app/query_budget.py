@@ -0,0 +1,80 @@
+# app/query_budget.py
+import asyncio
+import logging
+from contextvars import Context, ContextVar
+
+from sqlalchemy import event
+
+from app.database import engines
+from config import QUERY_BUDGETS, DEFAULT_QUERY_BUDGET, QUERY_BUDGET_STRICT
+
+logger = logging.getLogger(__name__)
+
+# Counts the SQL statements every request runs and checks them against a budget for its route, so a
+# new N+1 (a loop or template touching an unloaded relationship) is noticed instead of just slowing down
+
+# Statements run by the current request, None outside of one
+_statements = ContextVar("statements", default=None)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def detached_task(coro) -> asyncio.Task:
+    # Background task started from a request without being charged for its statements: a task copies the
+    # context it was created in, counter included, so it is created in an empty one
+    return Context().run(asyncio.get_running_loop().create_task, coro)
+
+
+def _count(conn, cursor, statement, parameters, context, executemany):
+    statements = _statements.get()
+    if statements is not None:
+        statements.append(statement)
+
+
+for _engine in set(engines.values()):
+    event.listen(_engine.sync_engine, "before_cursor_execute", _count)
+
+
+class QueryBudgetMiddleware:
+    # Logs requests that ran more statements than their route allows. With QUERY_BUDGET_STRICT (test runs) the
+    # request fails with QueryBudgetExceeded instead, before its response starts so the client gets the error;
+    # statements run while a body streams or in a background task can only fail it after the response went out
+
+    def __init__(self, app, budgets=None, default: int = DEFAULT_QUERY_BUDGET, strict: bool = QUERY_BUDGET_STRICT):
+        self.app = app
+        self.budgets = QUERY_BUDGETS if budgets is None else budgets
+        self.default = default
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        statements = []
+
+        async def checked_send(message):
+            if self.strict and message["type"] == "http.response.start":
+                self._check(scope, statements)
+            await send(message)
+
+        token = _statements.set(statements)
+        try:
+            await self.app(scope, receive, checked_send if self.strict else send)
+        finally:
+            _statements.reset(token)
+        self._check(scope, statements)
+
+    def _check(self, scope, statements: list):
+        # Budgets are keyed by route template ("/products/detail/{product_id}"), set once routing matched
+        route = scope.get("route")
+        path = route.path if route is not None else scope["path"]
+        budget = self.budgets.get(f"{scope['method']} {path}", self.default)
+        if len(statements) <= budget:
+            return
+
+        message = f"{scope['method']} {path} ran {len(statements)} queries, budget is {budget}"
+        if self.strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning("%s:\n%s", message, "\n".join(" ".join(statement.split())[:200] for statement in statements))
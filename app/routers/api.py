@@ -0,0 +1,94 @@
+# app/routers/api.py
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import get_current_user, get_products_page, get_categories
+from app.database import get_read_db
+from app.models import Product, Profile
+from app.schemas import ProductOut, CategoryOut, ProfileOut
+from config import PAGE_SIZE, API_MAX_PAGE_SIZE
+
+# Versioned JSON API for the mobile client, mounted under /api/v1. Responses are built with the
+# Pydantic schemas and written by orjson directly, skipping FastAPI's generic encoder
+
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Listings leave out the description unless it is asked for with ?fields=
+LIST_FIELDS = set(ProductOut.model_fields) - {"description"}
+
+
+def parse_fields(fields: str, default):
+    # Sparse fieldset: ?fields=id,name,price picks the keys of every returned product
+    if not fields:
+        return default
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected - set(ProductOut.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
+
+
+def serialize_product(request: Request, product: Product, fields) -> dict:
+    data = ProductOut.model_validate(product).model_dump(include=fields)
+    if data.get("image"):
+        data["image"] = str(request.url_for("static", path=data["image"]))
+    return data
+
+
+@router.get("/products")
+async def list_products(
+        request: Request,
+        q: str = '',
+        category: Optional[int] = None,
+        location: str = '',
+        cursor: str = '',
+        limit: int = PAGE_SIZE,
+        fields: str = '',
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        sort: str = '',
+        db: AsyncSession = Depends(get_read_db),
+):
+    # Same filters, orders and cursor as the home page; malformed numbers are a 422 here instead of being ignored
+    selected = parse_fields(fields, LIST_FIELDS)
+    limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+    products, next_cursor = await get_products_page(db, q, category, location, cursor, limit=limit,
+                                                    min_price=min_price, max_price=max_price, sort=sort)
+    return ORJSONResponse({
+        "items": [serialize_product(request, product, selected) for product in products],
+        "next_cursor": next_cursor,
+    })
+
+
+@router.get("/products/{product_id}")
+async def get_product(request: Request, product_id: int, fields: str = '', db: AsyncSession = Depends(get_read_db)):
+    product = await db.get(Product, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return ORJSONResponse(serialize_product(request, product, parse_fields(fields, None)))
+
+
+@router.get("/categories")
+async def list_categories(db: AsyncSession = Depends(get_read_db)):
+    # Served from the reference data cache
+    categories = await get_categories(db)
+    return ORJSONResponse([CategoryOut.model_validate(category).model_dump() for category in categories])
+
+
+@router.get("/profile")
+async def get_profile(request: Request, db: AsyncSession = Depends(get_read_db), current_user=Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    profile = (await db.execute(select(Profile).where(Profile.user_id == current_user.id))).scalars().first()
+    return ORJSONResponse(ProfileOut(
+        id=current_user.id,
+        username=current_user.username,
+        profile_picture=str(request.url_for("static", path=profile.profile_picture))
+        if profile and profile.profile_picture else None,
+        location=profile.location if profile else None,
+        bio=profile.bio if profile else None,
+    ).model_dump())
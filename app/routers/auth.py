@@ -2,11 +2,12 @@
 import jwt
 from fastapi import APIRouter, Depends, Form, HTTPException, Request
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import HTMLResponse
 from starlette.status import HTTP_303_SEE_OTHER
 
-from app.crud import create_user, get_user_by_username, delete_user, get_current_user, create_access_token, verify_password
+from app.crud import create_user, get_user_by_username, delete_user, get_current_user, create_access_token, authenticate_user, \
+    invalidate_reference_data, invalidate_pages, principal_claims
 from app.schemas import UserCreate
 from app.database import get_db
 from config import templates, SECRET_KEY, ALGORITHM
@@ -24,12 +25,12 @@ async def register(
         username: str = Form(...),
         password: str = Form(...),
         password_confirm: str = Form(...),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
 ):
     errors = {}
 
-    # Check if username already exists
-    if get_user_by_username(db, username):
+    # Check if username already exists, accounts pending deletion included
+    if await get_user_by_username(db, username, include_deleted=True):
         errors["username"] = "Username already taken."
 
     # Check if passwords match
@@ -46,10 +47,10 @@ async def register(
 
     # Create the user
     user_create = UserCreate(username=username, password=password, password_confirm=password_confirm)
-    user = create_user(db, user_create)
+    user = await create_user(db, user_create)
 
     # Automatically log in the user after registration
-    access_token = jwt.encode({"sub": user.username}, SECRET_KEY, algorithm=ALGORITHM)
+    access_token = jwt.encode({"sub": user.username, **principal_claims(user)}, SECRET_KEY, algorithm=ALGORITHM)
     response = RedirectResponse(url="/", status_code=HTTP_303_SEE_OTHER)
     response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
     return response
@@ -60,12 +61,12 @@ async def login_form(request: Request):
     return templates.TemplateResponse("registration/login.html", {"request": request, "errors": errors})
 
 @router.post("/login")
-async def login(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+async def login(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
     errors = {}
 
-    # Authenticate the user
-    user = get_user_by_username(db, username)
-    if not user or not verify_password(password, user.password):
+    # Authenticate the user, password work runs in the hashing pool
+    user = await authenticate_user(db, username, password)
+    if not user:
         errors["login"] = "Invalid username or password."
 
     # If there are errors, re-render the form with errors
@@ -76,7 +77,7 @@ async def login(request: Request, username: str = Form(...), password: str = For
             "errors": errors,
         })
 
-    access_token = create_access_token(data={"sub": username})
+    access_token = create_access_token(data={"sub": username, **principal_claims(user)})
     response = RedirectResponse(url="/", status_code=HTTP_303_SEE_OTHER)
     response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
     return response
@@ -90,11 +91,16 @@ async def logout():
 @router.post("/delete_account")
 async def delete_account(
         request: Request,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user = Depends(get_current_user)
 ):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
     # Delete the user from the database
-    delete_user(db, user_id=current_user.id)
+    await delete_user(db, user_id=current_user.id)
+    # The user's products leave the location list, the home grid and their detail pages
+    invalidate_reference_data()
+    invalidate_pages("home", f"user:{current_user.id}")
 
     # Remove the access_token by setting it to an empty value and a past expiration date
     response = RedirectResponse(url="/", status_code=HTTP_303_SEE_OTHER)
@@ -1,14 +1,21 @@
 # app/routers/main_routes.py
 
 from fastapi import APIRouter, Request, Depends
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-from starlette.responses import HTMLResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import ORJSONResponse
+from starlette.responses import HTMLResponse, PlainTextResponse
 
-from app.crud import get_current_user
-from app.database import get_db
-from app.models import Product, Category
-from config import templates
+from app.cache import cache_stats
+from app.crud import get_current_user, get_products_page, get_categories, get_locations, get_facet_counts, \
+    page_cache, parse_price, parse_category, SORTS
+from app.database import get_read_db, read_sessionmaker, database_stats
+from app.locations import location_index
+from app.metrics import render_metrics
+from app.passwords import password_stats
+from app.streaming import StreamingTemplateResponse, render_template
+from app.suggestions import product_suggestions
+from app.thumbnails import load_ready_widths
+from config import LOCATION_SUGGEST_LIMIT
 
 router = APIRouter()
 
@@ -19,57 +26,103 @@ async def home(
         q: str = '',
         category: str = '',
         location: str = '',
-        db: Session = Depends(get_db),
+        cursor: str = '',
+        min_price: str = '',
+        max_price: str = '',
+        sort: str = '',
+        db: AsyncSession = Depends(get_read_db),
         current_user=Depends(get_current_user),
 ):
-    # Fetch all categories from the database
-    categories = db.query(Category).all()
-
-    # Fetch all unique locations from products
-    locations = db.query(Product.location).distinct().all()
-    locations = [loc[0] for loc in locations]  # Extract the location strings
-
-    # Initialize the query to fetch all products
-    products_query = db.query(Product)
-
-    # Apply search filter if provided
-    if q:
-        products_query = products_query.filter(
-            or_(
-                Product.name.ilike(f"%{q}%"),
-                Product.description.ilike(f"%{q}%"),
-                Product.location.ilike(f"%{q}%")
-            )
-        )
-
-    # Apply category filter if selected
-    if category:
-        products_query = products_query.filter_by(category_id=category)
-
-    # Apply location filter if selected
-    if location:
-        products_query = products_query.filter_by(location=location)
-
-    # Execute the query to get the products
-    products = products_query.all()
-
-    # Fetch user's profile picture if authenticated
-    profile_picture = None
-    if current_user:
-        profile_picture = current_user.profile.profile_picture if current_user.profile.profile_picture else ""
+    async def context(load_products):
+        # Fetch all categories and unique product locations, both served from the reference data cache
+        categories = await get_categories(db)
+        locations = await get_locations(db)
+
+        # Product counts next to every category and location, under the current search and the other filter
+        category_counts, location_counts = await get_facet_counts(db, q, category, location, min_price, max_price)
+
+        # Fetch user's profile picture if authenticated, with its resized copies for the header
+        profile_picture = None
+        if current_user:
+            profile_picture = current_user.profile.profile_picture if current_user.profile.profile_picture else ""
+            await load_ready_widths(db, [profile_picture])
 
-    # Render the home template
-    return templates.TemplateResponse(
-        "app/home.html",
-        {
+        # The template calls load_products() for one page of matching products, newest first unless sorted
+        return {
             "request": request,
-            "products": products,
+            "load_products": load_products,
             "categories": categories,
             "locations": locations,
-            "selected_category": category,
+            "category_counts": category_counts,
+            "location_counts": location_counts,
             "selected_location": location,
+            # Normalized, the filter links repeat them
+            "selected_category": "" if parse_category(category) is None else parse_category(category),
+            "min_price": "" if parse_price(min_price) is None else parse_price(min_price),
+            "max_price": "" if parse_price(max_price) is None else parse_price(max_price),
+            "sort": sort if sort in SORTS else "",
             "profile_picture": profile_picture,
             "query": q,
             "current_user": current_user
-        },
-    )
+        }
+
+    if current_user:
+        # Streamed: the header goes out first, the product grid follows once its query is done. That query
+        # runs after the dependencies' session is closed, in a session of its own
+        async def load_products_streamed():
+            async with read_sessionmaker(request)() as stream_db:
+                products, next_cursor = await get_products_page(stream_db, q, category, location, cursor,
+                                                                min_price=min_price, max_price=max_price, sort=sort)
+                await load_ready_widths(stream_db, [product.image for product in products])
+                return products, next_cursor
+        return StreamingTemplateResponse("app/home.html", await context(load_products_streamed))
+
+    async def load_products():
+        products, next_cursor = await get_products_page(db, q, category, location, cursor, min_price=min_price,
+                                                        max_price=max_price, sort=sort)
+        await load_ready_widths(db, [product.image for product in products])
+        return products, next_cursor
+
+    # Anonymous visitors all get the same page, rendered once per filter combination. Any product
+    # write drops every "home" page, since new or changed products can land on any of them
+    async def render_cached():
+        return (await render_template("app/home.html", await context(load_products))).encode(), {"home"}
+    key = ("home", str(request.base_url), q, category, location, cursor, min_price, max_price, sort)
+    return HTMLResponse(await page_cache.get_or_render(key, render_cached))
+
+
+@router.get("/locations/suggest")
+async def suggest_locations(prefix: str = '', limit: int = LOCATION_SUGGEST_LIMIT, db: AsyncSession = Depends(get_read_db)):
+    # Autocomplete for the location field of the product forms, answered from the in-memory index
+    await location_index.ensure_loaded(db)
+    return ORJSONResponse(location_index.suggest(prefix, max(1, min(limit, LOCATION_SUGGEST_LIMIT))))
+
+
+@router.get("/cache/stats")
+async def cache_statistics():
+    # Hit/miss counters of the in-process caches
+    return cache_stats()
+
+
+@router.get("/db/stats")
+async def database_statistics():
+    # Connection pool usage and checkout wait times, per engine
+    return database_stats()
+
+
+@router.get("/passwords/stats")
+async def password_statistics():
+    # Hashing pool latency and queue depth
+    return password_stats()
+
+
+@router.get("/suggest/stats")
+async def suggestion_statistics():
+    # Size and estimated memory of the search box suggestion index
+    return product_suggestions.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Everything above plus route, SQL and template timings, in the Prometheus text format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,29 +1,35 @@
 # app/routers/product.py
-
-import os
-import shutil
+from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, Form, HTTPException, UploadFile, File, Request
-from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import RedirectResponse, HTMLResponse, ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from starlette.status import HTTP_303_SEE_OTHER
 
-from app.crud import get_current_user
-from app.database import get_db
+from app.cleanup import schedule_purge
+from app.conditional import page_etag, not_modified, with_etag
+from app.crud import get_current_user, get_products_page, get_categories, invalidate_reference_data, \
+    invalidate_pages, page_cache, lock_live_user
+from app.database import get_db, get_read_db
+from app.facets import adjust_facets
+from app.locations import resolve_location, remember_location
+from app.media import save_upload, release, delete_files, PRODUCT_IMAGES, DEFAULT_PRODUCT_IMAGE
 from app.models import Product, Category
 from app.schemas import UserResponse
-from config import templates
+from app.search import index_product
+from app.suggestions import product_suggestions
+from app.thumbnails import schedule_derivatives, image_srcset, load_ready_widths
+from config import PRODUCT_SUGGEST_LIMIT, templates
 
 router = APIRouter()
 
-PRODUCT_DIR = "app/static/media/product_images"
-
-
 @router.get("/new")
-async def new_product(request: Request, db: Session = Depends(get_db)):
+async def new_product(request: Request, db: AsyncSession = Depends(get_read_db)):
     errors = {}
     # Fetch all categories from the database
-    categories = db.query(Category).all()
+    categories = await get_categories(db)
     return templates.TemplateResponse("app/product_form.html", {
         "request": request,
         "errors": errors,
@@ -34,29 +40,38 @@ async def new_product(request: Request, db: Session = Depends(get_db)):
 @router.post("/new")
 async def new_product(name: str = Form(...), description: str = Form(...), price: int = Form(...),
                       location: str = Form(...), category: str = Form(...), new_category: str = Form(None),
-                      product_image: UploadFile = File(None), db: Session = Depends(get_db),
+                      product_image: UploadFile = File(None), db: AsyncSession = Depends(get_db),
                       current_user=Depends(get_current_user)):
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    if not await lock_live_user(db, current_user.id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    location_id, location = await resolve_location(db, location)
     if new_category:
         category_obj = Category(name=new_category)
         db.add(category_obj)
-        db.commit()
-        db.refresh(category_obj)
+        await db.flush()
     else:
-        category_obj = db.query(Category).filter_by(id=category).first()
-    if product_image.filename:
-        filename = f"{current_user.id}_{product_image.filename}"
-        file_path = os.path.join(PRODUCT_DIR, filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(product_image.file, buffer)
-        image_path = f"media/product_images/{filename}"
+        category_obj = await db.get(Category, int(category))
+    if product_image and product_image.filename:
+        image_path = await save_upload(db, product_image, PRODUCT_IMAGES)
     else:
-        image_path = "media/product_images/default_product.png"
+        image_path = DEFAULT_PRODUCT_IMAGE
     new_product = Product(name=name, description=description, price=price, location=location,
-                          image=image_path, category_id=category_obj.id, user_id=current_user.id)
+                          location_id=location_id, image=image_path, category_id=category_obj.id,
+                          user_id=current_user.id)
     db.add(new_product)
-    db.commit()
+    await db.flush()
+    await index_product(db, new_product)
+    await adjust_facets(db, [(new_product.category_id, location, 1)])
+    await db.commit()
+    remember_location(location_id, location)
+    invalidate_reference_data()
+    invalidate_pages("home")
+    if new_category:
+        product_suggestions.add_category(category_obj.id, category_obj.name)
+    product_suggestions.add(new_product.name)
+    schedule_derivatives(image_path)
     return RedirectResponse(url="/", status_code=303)
 
 
@@ -64,18 +79,24 @@ async def new_product(name: str = Form(...), description: str = Form(...), price
 async def product_edit(
         request: Request,
         product_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_read_db),
         current_user: UserResponse = Depends(get_current_user)
 ):
     errors = {}
 
-    # Fetch product for current user
-    product = db.query(Product).filter_by(id=product_id, creator=current_user).first()
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    # Fetch product for current user, with the category the form preselects
+    result = await db.execute(
+        select(Product).options(selectinload(Product.category)).filter_by(id=product_id, user_id=current_user.id)
+    )
+    product = result.scalars().first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
     # Fetch all categories
-    categories = db.query(Category).all()
+    categories = await get_categories(db)
 
     return templates.TemplateResponse("app/product_edit.html", {
         "request": request,
@@ -96,19 +117,27 @@ async def product_edit(
         category: str = Form(None),
         new_category: str = Form(None),
         product_image: UploadFile = File(None),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user=Depends(get_current_user)
 ):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
     # Fetch product for current user
-    product = db.query(Product).filter_by(id=product_id, creator=current_user).first()
+    result = await db.execute(select(Product).filter_by(id=product_id, user_id=current_user.id))
+    product = result.scalars().first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
+    # The facet counts move from the old category and location to the new ones, the suggestions to the new name
+    facet_changes = [(product.category_id, product.location, -1)]
+    old_name = product.name
+
     # Update product details
+    product.location_id, product.location = await resolve_location(db, location)
     product.name = name
     product.description = description
     product.price = price
-    product.location = location
 
     # Update category
     if new_category:
@@ -116,34 +145,37 @@ async def product_edit(
         new_category_obj = Category()
         new_category_obj.name = new_category
         db.add(new_category_obj)
-        db.commit()
-        db.refresh(new_category_obj)
+        await db.flush()
         product.category_id = new_category_obj.id
     elif category:
-        product.category_id = category
+        product.category_id = int(category)
 
     # Update product image if provided
+    orphaned_files = []
     if product_image:
-        # Delete the old image if it exists
-        if product.image:
-            old_image_path = os.path.join("app/static", product.image)
-            if os.path.exists(old_image_path) and not product.image == "media/product_images/default_product.png":
-                os.remove(old_image_path)
-
-        # Save the new image
+        # Save the new image first, so re-uploading the same picture never drops its last reference
         if product_image.filename:
-            filename = f"{product_id}_{product_image.filename}"
-            file_path = os.path.join("app/static/media/product_images", filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(product_image.file, buffer)
-
-            product.image = f"media/product_images/{filename}"
+            new_image = await save_upload(db, product_image, PRODUCT_IMAGES)
         else:
-            product.image = "media/product_images/default_product.png"
+            new_image = DEFAULT_PRODUCT_IMAGE
+
+        # Release the old image, its file goes once nothing else references it
+        orphaned_files = await release(db, product.image)
+        product.image = new_image
 
-    # Commit changes to the database
+    # Commit changes to the database, together with the refreshed search document
     db.add(product)
-    db.commit()
+    await index_product(db, product)
+    await adjust_facets(db, facet_changes + [(product.category_id, product.location, 1)])
+    await db.commit()
+    remember_location(product.location_id, product.location)
+    invalidate_reference_data()
+    invalidate_pages("home", f"product:{product_id}")
+    if new_category:
+        product_suggestions.add_category(product.category_id, new_category)
+    product_suggestions.rename(old_name, product.name)
+    await delete_files(orphaned_files)
+    schedule_derivatives(product.image)
 
     # Redirect to home after updating
     return RedirectResponse(url="/", status_code=HTTP_303_SEE_OTHER)
@@ -152,32 +184,118 @@ async def product_edit(
 @router.post("/delete/{product_id}")
 async def delete_product(
         product_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user: UserResponse = Depends(get_current_user)
 ):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
     # Get product by primary key and seller
-    product = db.query(Product).filter_by(id=product_id, creator=current_user).first()
+    result = await db.execute(select(Product).filter_by(id=product_id, user_id=current_user.id))
+    product = result.scalars().first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Delete the product from the session and commit to the database
-    db.delete(product)
-    db.commit()
+    # Hide the product now, the cleanup worker deletes the row, its search document and its image
+    product.deleted_at = datetime.now(timezone.utc)
+    await adjust_facets(db, [(product.category_id, product.location, -1)])
+    await db.commit()
+    invalidate_reference_data()
+    invalidate_pages("home", f"product:{product_id}")
+    product_suggestions.remove(product.name)
+    schedule_purge()
 
     # Redirect to profile after deletion
     return RedirectResponse(url="/profile", status_code=HTTP_303_SEE_OTHER)
 
 
+@router.get("/feed")
+async def product_feed(
+        request: Request,
+        q: str = '',
+        category: str = '',
+        location: str = '',
+        cursor: str = '',
+        min_price: str = '',
+        max_price: str = '',
+        sort: str = '',
+        db: AsyncSession = Depends(get_read_db),
+):
+    # Next page of the home grid for "load more", same filters, order and cursor as home()
+    products, next_cursor = await get_products_page(db, q, category, location, cursor, min_price=min_price,
+                                                    max_price=max_price, sort=sort)
+    await load_ready_widths(db, [product.image for product in products])
+    return {
+        "items": [
+            {
+                "id": product.id,
+                "name": product.name,
+                "description": product.description,
+                "price": product.price,
+                "image": str(request.url_for("static", path=product.image or "utils_img/default_product.png")),
+                "srcset": image_srcset({"request": request}, product.image),
+                "url": str(request.url_for("product_detail", product_id=product.id)),
+            }
+            for product in products
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/suggest")
+async def suggest_products(
+        request: Request,
+        q: str = '',
+        limit: int = PRODUCT_SUGGEST_LIMIT,
+        db: AsyncSession = Depends(get_read_db),
+):
+    # Search box completions from the in-memory index: a category opens its listing, a product name is searched
+    await product_suggestions.ensure_loaded(db)
+    home = request.url_for("home")
+    suggestions = []
+    for kind, name, value in product_suggestions.suggest(q, max(1, min(limit, PRODUCT_SUGGEST_LIMIT))):
+        if kind == "category":
+            suggestions.append({"kind": kind, "text": name, "url": str(home.include_query_params(category=value))})
+        else:
+            suggestions.append({"kind": kind, "text": name, "count": value})
+    return ORJSONResponse(suggestions)
+
+
 @router.get("/detail/{product_id}")
 async def product_detail(
         request: Request,
         product_id: int,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_read_db),
         current_user=Depends(get_current_user)
 ):
-    product = db.query(Product).filter_by(id=product_id).first()
-    return templates.TemplateResponse("app/product_detail.html", {
-        "request": request,
-        "product": product,
-        "current_user": current_user
-    })
+    # The page depends on the product, its category, the viewer (the edit button) and the deploy. A client
+    # holding the current version gets a 304 before the row is loaded
+    versions = (await db.execute(
+        select(Product.version_id, Category.version_id)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .where(Product.id == product_id)
+    )).first()
+    etag = page_etag("detail", product_id, *versions, current_user.id if current_user else None) if versions else None
+    response = not_modified(request, etag)
+    if response:
+        return response
+
+    async def render():
+        product = await db.get(Product, product_id)
+        return templates.TemplateResponse("app/product_detail.html", {
+            "request": request,
+            "product": product,
+            "current_user": current_user
+        }), product
+
+    if current_user:
+        return with_etag((await render())[0], etag)
+
+    # Anonymous detail pages are cached until the product or its seller changes
+    async def render_cached():
+        response, product = await render()
+        if product is None:
+            return response.body, None
+        return response.body, {f"product:{product_id}", f"user:{product.user_id}"}
+    key = ("detail", str(request.base_url), product_id)
+    return with_etag(HTMLResponse(await page_cache.get_or_render(key, render_cached)), etag)
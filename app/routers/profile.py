@@ -1,61 +1,98 @@
 # app/routers/profile.py
-import os
-import shutil
-from pathlib import Path
-
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from starlette.status import HTTP_303_SEE_OTHER
 
-from app.crud import get_current_user
-from app.database import get_db
-from app.schemas import UserResponse
-from config import templates
+from app.conditional import page_etag, not_modified, with_etag
+from app.crud import get_current_user, invalidate_principal, create_access_token, principal_claims
+from app.database import get_db, get_read_db, read_sessionmaker
+from app.media import save_upload, release, delete_files, ready_derivatives, parse_widths, PROFILE_PICS
+from app.models import Product, Profile, MediaFile
+from app.schemas import UserResponse, ProfileSummary
+from app.streaming import StreamingTemplateResponse
+from app.thumbnails import schedule_derivatives, load_ready_widths
 
 router = APIRouter()
 
-PROFILE_DIR = Path("app/static/media/profile_pics")
-
 
 @router.get("/")
-async def profile(request: Request, user: UserResponse = Depends(get_current_user)):
-    return templates.TemplateResponse("app/profile.html", {"request": request, "current_user": user})
+async def profile(request: Request, db: AsyncSession = Depends(get_read_db),
+                  user: UserResponse = Depends(get_current_user)):
+    # The page depends on the profile, the user's listing, which of their images have resized copies yet and the
+    # deploy. Count, newest id and summed versions of the products change with any insert, edit or delete, the
+    # ready images count and avatar widths once another process records derivatives, so the client's copy is
+    # checked with one query
+    etag = None
+    if user:
+        images, picture = aliased(MediaFile), aliased(MediaFile)
+        versions = (await db.execute(
+            select(Profile.version_id, func.count(Product.id), func.max(Product.id),
+                   func.coalesce(func.sum(Product.version_id), 0), func.count(images.derivative_widths),
+                   func.max(picture.derivative_widths))
+            .outerjoin(Product, Product.user_id == Profile.user_id)
+            .outerjoin(images, images.path == Product.image)
+            .outerjoin(picture, picture.path == Profile.profile_picture)
+            .where(Profile.user_id == user.id)
+            .group_by(Profile.version_id)
+        )).first()
+        etag = page_etag("profile", user.id, *versions) if versions else None
+        response = not_modified(request, etag)
+        if response:
+            return response
+        # The avatar's widths came with the versions, the header srcset needs no query of its own
+        if versions and versions[-1] is not None:
+            ready_derivatives.set(user.profile.profile_picture, parse_widths(versions[-1]))
+
+    # Streamed, the user's listing is loaded once the page header is out. The cached user carries no
+    # relationships, and the query runs after the dependencies' sessions are closed, in a session of its own
+    async def load_products():
+        if not user:
+            return []
+        async with read_sessionmaker(request)() as db:
+            products = (await db.execute(select(Product).where(Product.user_id == user.id))).scalars().all()
+            await load_ready_widths(db, [product.image for product in products])
+            return products
+    return with_etag(StreamingTemplateResponse("app/profile.html", {
+        "request": request,
+        "current_user": user,
+        "load_products": load_products,
+    }), etag)
 
 
 @router.post("/")
 async def upload_profile_photo(
         request: Request,
         profile_picture: UploadFile = File(...),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user=Depends(get_current_user),
 ):
     # Ensure the user is authenticated
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    # Path to the directory where profile pictures are stored
-    if not PROFILE_DIR.exists():
-        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
-
-    # Delete the old profile picture if it exists and is not the default one
-    old_picture_path = Path("app/static") / current_user.profile.profile_picture
-    if old_picture_path.exists() and "default.png" not in str(old_picture_path):
-        try:
-            os.remove(old_picture_path)
-        except Exception as e:
-            print(f"Error deleting old profile picture: {e}")
-
     # Save the uploaded file
-    filename = f"{current_user.id}_{profile_picture.filename}"
-    file_path = PROFILE_DIR / filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(profile_picture.file, buffer)
+    profile = (await db.execute(select(Profile).where(Profile.user_id == current_user.id))).scalars().one()
+    new_picture = await save_upload(db, profile_picture, PROFILE_PICS)
+
+    # Release the old profile picture, the default one is never removed
+    orphaned_files = await release(db, profile.profile_picture)
 
     # Update the user's profile picture in the database
-    current_user.profile.profile_picture = f"media/profile_pics/{filename}"
-    db.commit()
+    profile.profile_picture = new_picture
+    await db.commit()
+    invalidate_principal(current_user.username)
+    await delete_files(orphaned_files)
+    schedule_derivatives(new_picture)
 
     # Redirect back to the profile page after the upload
     response = RedirectResponse(url="/profile", status_code=HTTP_303_SEE_OTHER)
+
+    # Tokens carrying the picture as a claim have to be reissued
+    claims = principal_claims(current_user.model_copy(update={"profile": ProfileSummary.model_validate(profile)}))
+    if claims:
+        access_token = create_access_token(data={"sub": current_user.username, **claims})
+        response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
     return response
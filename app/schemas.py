@@ -1,4 +1,6 @@
 # app/schemas.py
+from datetime import datetime
+from typing import Optional
 
 from pydantic import BaseModel, field_validator
 from pydantic_core.core_schema import FieldValidationInfo
@@ -22,3 +24,48 @@ class UserResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class ProfileSummary(BaseModel):
+    profile_picture: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class CurrentUser(UserResponse):
+    # What handlers and templates need about the logged in user, cheap to cache and to carry in the JWT
+    profile: ProfileSummary
+
+
+# /api/v1 representations
+
+class ProductOut(BaseModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+    price: Optional[int] = None
+    location: Optional[str] = None
+    image: Optional[str] = None
+    category_id: Optional[int] = None
+    user_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class CategoryOut(BaseModel):
+    id: int
+    name: str
+
+    class Config:
+        from_attributes = True
+
+
+class ProfileOut(BaseModel):
+    id: int
+    username: str
+    profile_picture: Optional[str] = None
+    location: Optional[str] = None
+    bio: Optional[str] = None
@@ -0,0 +1,161 @@
+# app/search.py
+import re
+
+from sqlalchemy import Float, cast, column, func, literal_column, select, table, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Product
+
+# Full-text index over product name, location and description, kept outside the ORM models:
+# Postgres gets a tsvector side table with a GIN index, SQLite an FTS5 virtual table keyed by product id.
+# Both are maintained explicitly from the product write paths, see index_product / remove_products.
+
+# 'simple' configuration: no stemming or stop words, listings are written in several languages
+TS_CONFIG = "simple"
+
+# Relative weights of name, location and description hits
+PG_WEIGHTS = ("A", "B", "C")
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+product_search = table(
+    "product_search",
+    column("product_id"),
+    column("document", TSVECTOR),
+)
+product_fts = table("product_fts", column("rowid"))
+
+PG_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS product_search (
+        product_id INTEGER PRIMARY KEY REFERENCES products (id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_search_document ON product_search USING GIN (document)",
+)
+SQLITE_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, location, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+)
+
+
+def _dialect(db) -> str:
+    return db.bind.dialect.name
+
+
+def tokenize(q: str):
+    # Words of the query, anything else (quotes, operators) is dropped so user input can't break the syntax
+    return re.findall(r"\w+", q.lower())
+
+
+async def create_search_index(conn):
+    # Called with an AsyncConnection from init_db, idempotent
+    for ddl in PG_DDL if conn.dialect.name == "postgresql" else SQLITE_DDL:
+        await conn.execute(text(ddl))
+
+
+def _document(product: Product) -> dict:
+    return {
+        "id": product.id,
+        "name": product.name or "",
+        "location": product.location or "",
+        "description": product.description or "",
+    }
+
+
+async def _write_documents(db: AsyncSession, documents: list):
+    # executemany of (id, name, location, description) rows
+    if _dialect(db) == "postgresql":
+        await db.execute(text(f"""
+            INSERT INTO product_search (product_id, document)
+            VALUES (:id,
+                    setweight(to_tsvector('{TS_CONFIG}', :name), '{PG_WEIGHTS[0]}') ||
+                    setweight(to_tsvector('{TS_CONFIG}', :location), '{PG_WEIGHTS[1]}') ||
+                    setweight(to_tsvector('{TS_CONFIG}', :description), '{PG_WEIGHTS[2]}'))
+            ON CONFLICT (product_id) DO UPDATE SET document = excluded.document
+        """), documents)
+    else:
+        await db.execute(text("DELETE FROM product_fts WHERE rowid = :id"), documents)
+        await db.execute(text(
+            "INSERT INTO product_fts (rowid, name, location, description) VALUES (:id, :name, :location, :description)"
+        ), documents)
+
+
+async def index_product(db: AsyncSession, product: Product):
+    # Insert or refresh one product's document, inside the caller's transaction (product.id must be flushed)
+    await _write_documents(db, [_document(product)])
+
+
+async def index_rows(db: AsyncSession, rows):
+    # Batch variant of index_product for products inserted through Core: dicts with id, name, location
+    # and description
+    documents = [
+        {key: row.get(key) or "" for key in ("name", "location", "description")} | {"id": row["id"]}
+        for row in rows
+    ]
+    if documents:
+        await _write_documents(db, documents)
+
+
+async def remove_products(db: AsyncSession, product_ids):
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    if _dialect(db) == "postgresql":
+        await db.execute(product_search.delete().where(product_search.c.product_id.in_(product_ids)))
+    else:
+        await db.execute(product_fts.delete().where(product_fts.c.rowid.in_(product_ids)))
+
+
+def search_ranking(db: AsyncSession, q: str):
+    # Subquery of (product_id, rank) for products matching every word of `q` as a prefix,
+    # higher rank is more relevant. None when `q` has no searchable words
+    words = tokenize(q)
+    if not words:
+        return None
+
+    if _dialect(db) == "postgresql":
+        ts_query = func.to_tsquery(TS_CONFIG, " & ".join(f"{word}:*" for word in words))
+        document = product_search.c.document
+        # float8 so the rank round-trips exactly through the page cursor
+        rank = cast(func.ts_rank(document, ts_query), Float)
+        return (
+            select(product_search.c.product_id.label("product_id"), rank.label("rank"))
+            .where(document.op("@@")(ts_query))
+            .subquery("ranking")
+        )
+
+    match = " AND ".join(f'"{word}"*' for word in words)
+    weights = ", ".join(str(weight) for weight in FTS_WEIGHTS)
+    # bm25() is lower-is-better, negate it so both backends sort by rank descending
+    rank = cast(-literal_column(f"bm25(product_fts, {weights})"), Float)
+    return (
+        select(product_fts.c.rowid.label("product_id"), rank.label("rank"))
+        .where(literal_column("product_fts").op("MATCH")(match))
+        .subquery("ranking")
+    )
+
+
+async def rebuild_search_index(db: AsyncSession, batch_size: int = 500):
+    # Backfill for databases created before the index existed, walks products in id batches
+    if _dialect(db) == "postgresql":
+        await db.execute(text("DELETE FROM product_search"))
+    else:
+        await db.execute(text("DELETE FROM product_fts"))
+
+    last_id = 0
+    while True:
+        result = await db.execute(
+            select(Product).where(Product.id > last_id).order_by(Product.id).limit(batch_size)
+        )
+        products = result.scalars().all()
+        if not products:
+            break
+        await _write_documents(db, [_document(product) for product in products])
+        last_id = products[-1].id
+        db.expunge_all()
+    await db.commit()
@@ -20,4 +20,47 @@ function closeNav() {
 
 function uploadPicture() {
         document.getElementById('uploadForm').submit();
-    }
\ No newline at end of file
+    }
+
+// Fills the search box's datalist from /products/suggest: product names fill the box, a category opens its
+// listing once picked (openSuggestion)
+function suggestProducts(input, url) {
+    fetch(url + '?q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (suggestions) {
+            var list = document.getElementById(input.getAttribute('list'));
+            list.innerHTML = '';
+            input.suggestionUrls = {};
+            suggestions.forEach(function (suggestion) {
+                var option = document.createElement('option');
+                option.value = suggestion.text;
+                option.label = suggestion.kind === 'category' ? 'Category' : suggestion.count + ' listed';
+                list.appendChild(option);
+                if (suggestion.url && !(suggestion.text in input.suggestionUrls)) {
+                    input.suggestionUrls[suggestion.text] = suggestion.url;
+                }
+            });
+        });
+}
+
+function openSuggestion(input) {
+    var url = input.suggestionUrls && input.suggestionUrls[input.value];
+    if (url) {
+        window.location = url;
+    }
+}
+
+// Fills the location field's datalist with known spellings from /locations/suggest
+function suggestLocations(input, url) {
+    fetch(url + '?prefix=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (names) {
+            var list = document.getElementById(input.getAttribute('list'));
+            list.innerHTML = '';
+            names.forEach(function (name) {
+                var option = document.createElement('option');
+                option.value = name;
+                list.appendChild(option);
+            });
+        });
+}
@@ -0,0 +1,64 @@
+# app/streaming.py
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from starlette.responses import StreamingResponse
+
+from config import STREAM_CHUNK_SIZE, TEMPLATE_CACHE_DIR, templates
+
+# Streamed HTML pages. They render with Jinja's generate_async from an async overlay of the app's environment
+# (same loader, globals and filters), so the head and header chrome are on the wire while the page's main query
+# is still running. The template calls that query itself, e.g. {% set products, next_cursor = load_products() %},
+# right after {{ stream_flush() }} sends everything rendered so far. Elsewhere output is sent in chunks of
+# STREAM_CHUNK_SIZE instead of one write per template fragment
+
+FLUSH = Markup("<!-- flush -->")
+
+_async_env = None
+
+
+def stream_flush():
+    # Template global: a marker the streaming response turns into a flush; rendered in full it is a comment
+    return FLUSH
+
+
+def async_env():
+    # Created on first use, after main.py has instrumented and extended the synchronous environment. It gets its own
+    # template cache, an overlay would otherwise start from copies of the synchronous templates, and its own bytecode
+    # files, since the bytecode cache key doesn't tell the two kinds of compiled code apart
+    global _async_env
+    if _async_env is None:
+        _async_env = templates.env.overlay(
+            enable_async=True, cache_size=templates.env.cache.capacity,
+            bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR, "__jinja2_async_%s.cache"),
+        )
+    return _async_env
+
+
+async def _chunks(pieces):
+    buffer = []
+    size = 0
+    async for piece in pieces:
+        if piece == FLUSH:
+            if buffer:
+                yield "".join(buffer)
+                buffer, size = [], 0
+            continue
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class StreamingTemplateResponse(StreamingResponse):
+    def __init__(self, name: str, context: dict, status_code: int = 200, headers=None):
+        template = async_env().get_template(name)
+        super().__init__(_chunks(template.generate_async(context)), status_code=status_code, headers=headers,
+                         media_type="text/html")
+
+
+async def render_template(name: str, context: dict) -> str:
+    # The same templates rendered in full, for pages that are cached
+    return await async_env().get_template(name).render_async(context)
@@ -0,0 +1,244 @@
+# app/suggestions.py
+import bisect
+import logging
+import re
+import sys
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import ReadSessionLocal
+from app.models import Category, Product
+from app.query_budget import detached_task
+from config import PRODUCT_SUGGEST_MAX_NAMES, PRODUCT_SUGGEST_SCAN, PRODUCT_SUGGEST_TTL
+
+logger = logging.getLogger(__name__)
+
+# Search-as-you-type for the home search box, answered from memory instead of running a search per keystroke.
+# Distinct product names, with how many live products carry each, and category names are kept the way
+# app/locations.py keeps locations: a sorted array of normalized names and one of the suffixes starting at each
+# later word ("chair" -> "red chair"), so a prefix is a bisect plus a short scan. Built from one streamed pass over
+# the names, kept current by the product and account routes, and reloaded in the background every
+# PRODUCT_SUGGEST_TTL seconds for other processes' writes. At most PRODUCT_SUGGEST_MAX_NAMES product names are
+# held, a load keeps the most common ones
+
+
+def suggest_key(text: str) -> str:
+    return " ".join((text or "").split()).casefold()
+
+
+def _display(name: str, key: str) -> str:
+    # The seller's spelling, sharing the key's string when it is already lower case
+    name = " ".join(name.split())
+    return key if name == key else name
+
+
+def _word_suffixes(key: str):
+    # (key, offset) of every later word, sorted by the suffix from there on without holding a copy of it
+    return [(key, match.start()) for match in re.finditer(r"\w+", key) if match.start()]
+
+
+def _count(names: dict, name: str, delta: int) -> bool:
+    # Adds `delta` live products to `name` in a key -> [display name, live products] dict, dropping names with
+    # none left. False when a new name didn't fit under PRODUCT_SUGGEST_MAX_NAMES
+    key = suggest_key(name)
+    entry = names.get(key)
+    if entry is not None:
+        entry[1] += delta
+        if entry[1] <= 0:
+            del names[key]
+    elif key and delta > 0:
+        if len(names) >= PRODUCT_SUGGEST_MAX_NAMES:
+            return False
+        names[key] = [_display(name, key), delta]
+    return True
+
+
+def _suffix(entry):
+    key, offset = entry
+    return key[offset:], key
+
+
+class _Suffixes:
+    # A (key, offset) list seen as the (suffix, key) pairs it is sorted by, for bisect (no key= before Python 3.10)
+    def __init__(self, entries: list):
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return _suffix(self.entries[index])
+
+
+def _find(words: list, target: tuple) -> int:
+    return bisect.bisect_left(_Suffixes(words), target)
+
+
+def _prefixed(keys: list, words: list, prefix: str, limit: int) -> dict:
+    # key -> 0 for keys starting with `prefix`, 1 for keys with a later word starting with it; at most `limit`
+    matches = {}
+    index = bisect.bisect_left(keys, prefix)
+    while index < len(keys) and len(matches) < limit and keys[index].startswith(prefix):
+        matches[keys[index]] = 0
+        index += 1
+    index = _find(words, (prefix,))
+    while index < len(words) and len(matches) < limit and words[index][0].startswith(prefix, words[index][1]):
+        matches.setdefault(words[index][0], 1)
+        index += 1
+    return matches
+
+
+class SuggestionIndex:
+    # One per process, see product_suggestions below. Everything runs on the event loop, no locking
+
+    def __init__(self):
+        self._names = {}  # key -> [display name, live products]
+        self._keys = []
+        self._words = []
+        self._categories = {}  # key -> (id, name)
+        self._category_keys = []
+        self._category_words = []
+        self.dropped = 0  # product names left out because the index was full
+        self.loaded_at = None
+        self._changes = None  # product name changes made while a load runs, replayed on top of it
+        self._reload = None
+        self._expired = False
+
+    async def load(self, db: AsyncSession):
+        # Names grouped in the database and streamed most common first, so a full index keeps those. Writes
+        # committed around the start of the query may be counted twice or missed until the next load
+        self._expired = False
+        categories = {
+            suggest_key(name): (category_id, name)
+            for category_id, name in (await db.execute(select(Category.id, Category.name))).all()
+        }
+        self._changes = []
+        try:
+            names, dropped = {}, 0
+            count = func.count().label("count")
+            rows = await db.stream(
+                select(Product.name, count).group_by(Product.name).order_by(count.desc(), Product.name)
+                .execution_options(yield_per=1000)
+            )
+            async for name, products in rows:
+                key = suggest_key(name)
+                if not key:
+                    continue
+                if key in names:
+                    names[key][1] += products
+                elif len(names) < PRODUCT_SUGGEST_MAX_NAMES:
+                    names[key] = [_display(name, key), products]
+                else:
+                    dropped += 1
+            # Writes made while the names streamed in are counted before the sorted arrays are built, once
+            for name, delta in self._changes:
+                if not _count(names, name, delta):
+                    dropped += 1
+            # Swapped in whole, suggest() never sees a half built index
+            self._names, self._keys = names, sorted(names)
+            self._words = sorted((entry for key in names for entry in _word_suffixes(key)), key=_suffix)
+            self._categories, self._category_keys = categories, sorted(categories)
+            self._category_words = sorted((entry for key in categories for entry in _word_suffixes(key)), key=_suffix)
+            self.dropped = dropped
+            self.loaded_at = time.monotonic()
+        finally:
+            self._changes = None
+
+    async def _reload_in_background(self):
+        try:
+            async with ReadSessionLocal() as db:
+                await self.load(db)
+        except Exception:
+            logger.exception("Reloading product suggestions failed")
+
+    async def ensure_loaded(self, db: AsyncSession):
+        # Loaded on first use; once stale it keeps answering while a reload runs
+        if self.loaded_at is None:
+            await self.load(db)
+        elif (self._expired or time.monotonic() - self.loaded_at > PRODUCT_SUGGEST_TTL) \
+                and (self._reload is None or self._reload.done()):
+            # Detached from the request that noticed, which isn't charged for the reload's statements
+            self._reload = detached_task(self._reload_in_background())
+
+    def _apply(self, name: str, delta: int):
+        # One write to the live index: the sorted arrays change only when a name comes or goes
+        key = suggest_key(name)
+        known = key in self._names
+        if not _count(self._names, name, delta):
+            self.dropped += 1
+        elif known and key not in self._names:
+            del self._keys[bisect.bisect_left(self._keys, key)]
+            for entry in _word_suffixes(key):
+                del self._words[_find(self._words, _suffix(entry))]
+        elif not known and key in self._names:
+            bisect.insort(self._keys, key)
+            for entry in _word_suffixes(key):
+                self._words.insert(_find(self._words, _suffix(entry)), entry)
+
+    def change(self, name: str, delta: int):
+        # A committed write: `delta` live products more (or fewer) carry `name`
+        if self._changes is not None:
+            self._changes.append((name, delta))
+        self._apply(name, delta)
+
+    def expire(self):
+        # For writes touching too many names to apply one by one, like an account deletion: the next suggest()
+        # call starts a background reload
+        self._expired = True
+
+    def add(self, name: str):
+        self.change(name, 1)
+
+    def remove(self, name: str):
+        self.change(name, -1)
+
+    def rename(self, old: str, new: str):
+        if suggest_key(old) != suggest_key(new):
+            self.remove(old)
+            self.add(new)
+
+    def add_category(self, category_id: int, name: str):
+        key = suggest_key(name)
+        if key and key not in self._categories:
+            self._categories[key] = (category_id, name)
+            bisect.insort(self._category_keys, key)
+            for entry in _word_suffixes(key):
+                self._category_words.insert(_find(self._category_words, _suffix(entry)), entry)
+
+    def suggest(self, q: str, limit: int):
+        # [(kind, name, category id or product count)]: matching categories first, up to half of `limit`, then
+        # product names. Names starting with `q` come before names with a later word starting with it, then the
+        # most listed; only the first PRODUCT_SUGGEST_SCAN matches are ranked, so short prefixes are as cheap
+        # as long ones
+        prefix = suggest_key(q)
+        if not prefix:
+            return []
+        categories = _prefixed(self._category_keys, self._category_words, prefix, max(1, limit // 2))
+        suggestions = []
+        for key in sorted(categories, key=categories.get):
+            category_id, name = self._categories[key]
+            suggestions.append(("category", name, category_id))
+        names = _prefixed(self._keys, self._words, prefix, PRODUCT_SUGGEST_SCAN)
+        ranked = sorted(names, key=lambda key: (names[key], -self._names[key][1], key))
+        suggestions += [("product", *self._names[key]) for key in ranked[:limit - len(suggestions)]]
+        return suggestions
+
+    def stats(self) -> dict:
+        # Entries and an estimate of the memory they hold, computed on request
+        objects = [self._names, self._keys, self._words, *self._keys, *self._words, *self._names.values()]
+        objects += [name for name, _ in self._names.values() if name not in self._names]
+        size = sum(map(sys.getsizeof, objects))
+        return {
+            "names": len(self._names),
+            "name_limit": PRODUCT_SUGGEST_MAX_NAMES,
+            "dropped": self.dropped,
+            "word_entries": len(self._words),
+            "categories": len(self._categories),
+            "bytes": size,
+            "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+        }
+
+
+product_suggestions = SuggestionIndex()
@@ -0,0 +1,172 @@
+# app/thumbnails.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from jinja2 import pass_context
+from PIL import Image, ImageOps
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import SessionLocal, engine
+from app.media import STATIC_DIR, PRODUCT_IMAGES, PROFILE_PICS, DEFAULT_IMAGES, derivative_path, ready_derivatives, \
+    format_widths, parse_widths
+from app.models import MediaFile
+from app.query_budget import detached_task
+from config import IMAGE_DERIVATIVE_WIDTHS, IMAGE_DERIVATIVE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Resized WebP and JPEG copies of uploaded images, so cards and avatars don't download the original.
+# Generated on a worker pool after the upload has been committed, never on the request path, and recorded in
+# media_files.derivative_widths for every process to see. Templates keep pointing at the original until then;
+# routes load the widths of the images they show with load_ready_widths() and rendering reads them from memory
+
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_DERIVATIVE_WORKERS, thread_name_prefix="thumbnails")
+
+# Path -> task generating it while queued or running, so the same image is never processed twice at once
+_pending = {}
+
+# Widths of the default images, which have no media_files row: generated at startup, kept for the process
+_default_widths = {}
+
+
+def generate_derivatives(path: str):
+    # Write every width and format for one image under app/static, blocking; runs on the pool
+    with Image.open(os.path.join(STATIC_DIR, path)) as source:
+        image = ImageOps.exif_transpose(source)
+        # Never upscale, images narrower than every width are served as they are
+        widths = [width for width in IMAGE_DERIVATIVE_WIDTHS if width < image.width]
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for extension, image_format in FORMATS.items():
+                target = os.path.join(STATIC_DIR, derivative_path(path, width, extension))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                frame = resized
+                if image_format == "JPEG" and frame.mode != "RGB":
+                    frame = frame.convert("RGB")
+                elif frame.mode not in ("RGB", "RGBA"):
+                    frame = frame.convert("RGBA")
+                # Written aside and renamed, so a half-written file is never served
+                temp = f"{target}.{threading.get_ident()}.tmp"
+                frame.save(temp, image_format, quality=80)
+                os.replace(temp, target)
+    return widths
+
+
+async def record_derivatives(db: AsyncSession, generated: dict):
+    # Path -> widths of finished derivatives into media_files, in one executemany UPDATE
+    if not generated:
+        return
+    media = MediaFile.__table__
+    await db.execute(
+        update(media).where(media.c.path == bindparam("generated_path")).values(derivative_widths=bindparam("widths")),
+        [{"generated_path": path, "widths": format_widths(widths)} for path, widths in generated.items()],
+    )
+
+
+async def _generate(path: str):
+    try:
+        widths = await asyncio.get_running_loop().run_in_executor(_executor, generate_derivatives, path)
+        if path in DEFAULT_IMAGES:
+            _default_widths[path] = widths
+            return
+        async with SessionLocal() as db:
+            await record_derivatives(db, {path: widths})
+            await db.commit()
+        ready_derivatives.set(path, widths)
+    except Exception:
+        logger.exception("Generating derivatives for %s failed", path)
+    finally:
+        _pending.pop(path, None)
+
+
+def schedule_derivatives(path: str):
+    # Queue generation for a freshly stored upload and return immediately. save_upload() has told the ready cache
+    # whether the copies exist, a path whose files were deleted and uploaded again is generated again
+    if path and ready_derivatives.get(path) is None and path not in _default_widths and path not in _pending:
+        _pending[path] = detached_task(_generate(path))
+
+
+async def drain_derivatives(limit: int = 0):
+    # Wait until at most `limit` images are queued or being generated. Bulk imports bound their backlog with it
+    # and wait for all of it before exiting
+    while len(_pending) > limit:
+        await asyncio.wait(list(_pending.values()), return_when=asyncio.FIRST_COMPLETED)
+
+
+async def load_ready_widths(db: AsyncSession, paths):
+    # Loads what media_files knows about `paths` the ready cache doesn't, in one query at most, so the srcsets
+    # rendered next include copies other processes generated
+    missing = {
+        path for path in paths
+        if path and path not in DEFAULT_IMAGES and path not in _pending and ready_derivatives.get(path) is None
+    }
+    if missing:
+        rows = await db.execute(
+            select(MediaFile.path, MediaFile.derivative_widths)
+            .where(MediaFile.path.in_(missing), MediaFile.derivative_widths.is_not(None))
+        )
+        for path, widths in rows:
+            ready_derivatives.set(path, parse_widths(widths))
+
+
+def prepare_default_derivatives():
+    # Blocking, at startup: copies of the default images, written by whichever process starts first
+    for path in DEFAULT_IMAGES:
+        smallest = derivative_path(path, IMAGE_DERIVATIVE_WIDTHS[0], "webp")
+        if os.path.exists(os.path.join(STATIC_DIR, smallest)):
+            _default_widths[path] = [
+                width for width in IMAGE_DERIVATIVE_WIDTHS
+                if os.path.exists(os.path.join(STATIC_DIR, derivative_path(path, width, "jpg")))
+            ]
+        else:
+            _default_widths[path] = generate_derivatives(path)
+
+
+def ready_widths(path: str):
+    # From memory only, rendering never touches the disk or the database
+    widths = _default_widths.get(path)
+    if widths is None:
+        widths = ready_derivatives.get(path)
+    return widths or []
+
+
+@pass_context
+def image_srcset(context, path: str, extension: str = "webp") -> str:
+    # srcset of the derivatives of `path` in one format, empty until they are ready
+    request = context["request"]
+    return ", ".join(
+        f"{request.url_for('static', path=derivative_path(path, width, extension))} {width}w"
+        for width in ready_widths(path)
+    )
+
+
+async def _record_backfill(generated: dict):
+    try:
+        async with SessionLocal() as db:
+            await record_derivatives(db, generated)
+            await db.commit()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    # Backfill: python -m app.thumbnails generates derivatives for every stored image and records them
+    generated = {}
+    for directory in (PRODUCT_IMAGES, PROFILE_PICS):
+        for filename in sorted(os.listdir(os.path.join(STATIC_DIR, directory))):
+            if filename.startswith("."):
+                continue
+            path = f"{directory}/{filename}"
+            try:
+                generated[path] = generate_derivatives(path)
+            except Exception as e:
+                print(f"Skipping {path}: {e}", file=sys.stderr)
+    asyncio.run(_record_backfill(generated))
@@ -0,0 +1,101 @@
+# benchmarks/plans.py
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+
+from sqlalchemy import event
+
+# Query plans of the product listing for every filter, price range and order home() and /api/v1/products offer,
+# against a seeded database. Each listing should walk one index in order: no full table scan, no sort step, so
+# the cost stays a handful of index entries per page however many products there are. The plan explained is the
+# second page's, which includes the keyset seek:
+#
+#   python -m benchmarks.plans --products 200000
+#
+# benchmarks/run.py adds the same report to its results
+
+SORTS = ("newest", "price_asc", "price_desc")
+
+
+def combinations(info: dict):
+    # (filters, sort) for every combination, with the first category and location of the seed
+    category, location = str(info["categories"][0]), info["locations"][0]
+    filters = ({}, {"category": category}, {"location": location}, {"category": category, "location": location})
+    price_ranges = ({}, {"min_price": "100", "max_price": "500"})
+    for (base, prices), sort in itertools.product(itertools.product(filters, price_ranges), SORTS):
+        yield base | prices, sort
+
+
+def _verdict(dialect: str, plan: list, filters: dict, sort: str) -> dict:
+    text = "\n".join(plan)
+    if dialect == "sqlite":
+        full_scan = any(line.startswith("SCAN products") and "INDEX" not in line for line in plan)
+        sorts = "TEMP B-TREE" in text
+    else:
+        full_scan = "Seq Scan on products" in text
+        sorts = any(line.lstrip("-> ").startswith(("Sort", "Incremental Sort")) for line in plan)
+    # Newest first within a price range may read the range from a price index and sort just those rows,
+    # which the planner prefers when the range is narrow
+    range_sort = sort == "newest" and "min_price" in filters
+    return {"full_scan": full_scan, "sorts": sorts, "ok": not full_scan and (not sorts or range_sort)}
+
+
+async def explain_listings(info: dict) -> list:
+    from app.crud import get_products_page
+    from app.database import SessionLocal, engine
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    results = []
+    async with SessionLocal() as db:
+        dialect = db.bind.dialect.name
+        prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+        for filters, sort in combinations(info):
+            _, cursor = await get_products_page(db, sort=sort, **filters)
+            # The statement of the next page, as the application sends it, soft delete criteria included
+            event.listen(engine.sync_engine, "before_cursor_execute", capture)
+            try:
+                await get_products_page(db, cursor=cursor or "", sort=sort, **filters)
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", capture)
+            statement, parameters = statements[-1]
+            connection = await db.connection()
+            rows = (await connection.exec_driver_sql(prefix + statement, parameters)).all()
+            plan = [row[-1] for row in rows]
+            results.append({"filters": filters, "sort": sort, "plan": plan} | _verdict(dialect, plan, filters, sort))
+    return results
+
+
+async def main(args):
+    from benchmarks.seed import seed
+    from app.database import engine
+
+    info = await seed(args.users, args.categories, args.products, args.seed)
+    try:
+        results = await explain_listings(info)
+    finally:
+        await engine.dispose()
+    print(json.dumps(results, indent=2))
+    bad = [result for result in results if not result["ok"]]
+    if bad:
+        print(f"{len(bad)} of {len(results)} listings scan the table or sort", file=sys.stderr)
+    raise SystemExit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Explain the product listing queries")
+    parser.add_argument("--database-url", help="database to seed, wiped first (default: ./benchmark.db)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from benchmarks.run import use_database
+    use_database(args.database_url)
+    asyncio.run(main(args))
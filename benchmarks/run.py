@@ -0,0 +1,310 @@
+# benchmarks/run.py
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+# Latency benchmark of the hot endpoints. Seeds a database, then drives the app in-process through
+# httpx's ASGI transport and/or over HTTP against real uvicorn workers, and writes p50/p95/p99 latency and
+# requests/second per scenario as JSON, so runs from different commits can be diffed:
+#
+#   python -m benchmarks.run --products 20000 --requests 500 --output before.json
+#
+# Without --database-url it uses a fresh SQLite file, ./benchmark.db
+
+DEFAULT_DATABASE = "benchmark.db"
+
+
+def use_database(database_url: str = None):
+    # The run wipes its database, so it never falls back to a DATABASE_URL exported in the shell
+    if not database_url:
+        if os.path.exists(DEFAULT_DATABASE):
+            os.remove(DEFAULT_DATABASE)
+        database_url = f"sqlite+aiosqlite:///./{DEFAULT_DATABASE}"
+    os.environ["DATABASE_URL"] = database_url
+
+
+def _png(i: int) -> bytes:
+    # Small image with different bytes per request, so uploads are not deduplicated
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), ((i * 7) % 256, (i * 13) % 256, (i * 29) % 256)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+# Scenarios: (needs a logged in client, expected status, request function). Home search, filters and detail run
+# logged in, which bypasses the anonymous page cache and exercises get_current_user; "home" is the cached page
+
+async def home(client, info, i, rng):
+    return await client.get("/")
+
+
+async def home_search(client, info, i, rng):
+    return await client.get("/", params={"q": rng.choice(info["words"])})
+
+
+async def home_filter(client, info, i, rng):
+    return await client.get("/", params={
+        "category": rng.choice(info["categories"]),
+        "location": rng.choice(info["locations"]),
+    })
+
+
+async def home_price(client, info, i, rng):
+    low = rng.randint(1, 1500)
+    return await client.get("/", params={
+        "category": rng.choice(info["categories"]),
+        "min_price": low,
+        "max_price": low + 500,
+        "sort": rng.choice(("price_asc", "price_desc")),
+    })
+
+
+async def product_detail(client, info, i, rng):
+    first_id, last_id = info["product_ids"]
+    return await client.get(f"/products/detail/{rng.randint(first_id, last_id)}")
+
+
+async def login(client, info, i, rng):
+    from benchmarks.seed import SEED_PASSWORD, username
+    return await client.post("/auth/login", data={
+        "username": username(rng.randrange(info["users"])), "password": SEED_PASSWORD,
+    })
+
+
+async def register(client, info, i, rng):
+    name = f"bench_{info['run']}_{i}"
+    return await client.post("/auth/register", data={
+        "username": name, "password": "benchmark", "password_confirm": "benchmark",
+    })
+
+
+async def upload(client, info, i, rng):
+    return await client.post(
+        "/products/new",
+        data={
+            "name": f"Upload {i}", "description": "Benchmark upload", "price": "10",
+            "location": rng.choice(info["locations"]), "category": str(rng.choice(info["categories"])),
+        },
+        files={"product_image": (f"upload_{i}.png", _png(i), "image/png")},
+    )
+
+
+SCENARIOS = {
+    "home": (False, 200, home),
+    "home_search": (True, 200, home_search),
+    "home_filter": (True, 200, home_filter),
+    "home_price": (True, 200, home_price),
+    "product_detail": (True, 200, product_detail),
+    "login": (False, 303, login),
+    "register": (False, 303, register),
+    "upload": (True, 303, upload),
+}
+
+
+def percentile(sorted_values, p: float):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+async def run_scenario(make_client, name: str, info: dict, requests: int, concurrency: int, warmup: int):
+    logged_in, expected_status, scenario = SCENARIOS[name]
+    rng = random.Random(f"{info['seed']}-{name}")
+    counter = itertools.count()
+    # Fresh usernames for every run of the register scenario
+    info = {**info, "run": time.time_ns()}
+
+    async with make_client() as client:
+        if logged_in:
+            await login(client, {**info, "users": 1}, 0, rng)
+        for _ in range(warmup):
+            await scenario(client, info, next(counter), rng)
+
+        latencies = []
+        errors = 0
+        remaining = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    response = await scenario(client, info, next(counter), rng)
+                    ok = response.status_code == expected_status
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": round(requests / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 3) for p in (50, 95, 99)},
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def start_uvicorn(port: int, workers: int):
+    # (server, seconds until it answered). The probe touches neither the database nor a template, so the first
+    # timed request still finds the worker as the lifespan left it
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        env=os.environ.copy(),
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics").status_code == 200:
+                return server, time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 30 seconds")
+
+
+async def remove_uploads():
+    # The upload scenario stores real files under app/static/media, drop them with the benchmark data
+    from sqlalchemy import select
+    from app.database import SessionLocal
+    from app.media import delete_files
+    from app.models import MediaFile
+    async with SessionLocal() as db:
+        paths = (await db.scalars(select(MediaFile.path))).all()
+    await delete_files(paths)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def first_request(port: int) -> dict:
+    # Latency of the first home page a fresh uvicorn serves, to compare with the home scenario's steady state
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+        started = time.perf_counter()
+        response = await client.get("/")
+        return {"status": response.status_code, "ms": round((time.perf_counter() - started) * 1000, 3)}
+
+
+async def run_modes(args, info: dict, modes, results: list, startup: dict):
+    for mode in modes:
+        async with contextlib.AsyncExitStack() as stack:
+            if mode == "inprocess":
+                from app.main import app
+                # ASGITransport doesn't run the lifespan. Without it the app would be measured before its warmup,
+                # location index and cleanup worker, not the way a server runs it
+                await stack.enter_async_context(app.router.lifespan_context(app))
+                transport = httpx.ASGITransport(app=app)
+
+                def make_client():
+                    return httpx.AsyncClient(transport=transport, base_url="http://benchmark")
+            else:
+                server, ready_seconds = start_uvicorn(args.port, args.workers)
+                stack.callback(server.wait)
+                stack.callback(server.terminate)
+                startup.update(ready_seconds=round(ready_seconds, 3), first_home=await first_request(args.port))
+                print(f"uvicorn ready in {ready_seconds:.2f} s, first home page {startup['first_home']['ms']:.2f} ms",
+                      file=sys.stderr)
+                limits = httpx.Limits(max_connections=args.concurrency)
+
+                def make_client():
+                    return httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60)
+
+            for name in args.scenarios:
+                result = await run_scenario(make_client, name, info, args.requests, args.concurrency, args.warmup)
+                result["mode"] = mode
+                results.append(result)
+                print(f"{mode:9} {name:15} {result['rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                      f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}",
+                      file=sys.stderr)
+
+
+async def main(args):
+    # The app reads DATABASE_URL on import, so nothing from app/ is imported before it is set
+    from benchmarks.plans import explain_listings
+    from benchmarks.seed import seed
+    from app.database import engine
+
+    info = await seed(args.users, args.categories, args.products, args.seed)
+    plans = await explain_listings(info)
+    await engine.dispose()
+
+    results = []
+    startup = {}
+    modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+    try:
+        await run_modes(args, info, modes, results, startup)
+    finally:
+        await remove_uploads()
+        await engine.dispose()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": os.environ["DATABASE_URL"].split("://")[0],
+        "seed": {key: info[key] for key in ("users", "products", "seed")} | {"categories": len(info["categories"])},
+        "settings": {key: getattr(args, key) for key in ("requests", "concurrency", "warmup", "workers")},
+        "results": results,
+        # uvicorn mode: seconds until the workers answered and the first home page's latency
+        "startup": startup or None,
+        # Listing query plans at this row count, see benchmarks/plans.py
+        "plans": plans,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot endpoints")
+    parser.add_argument("--database-url", help="database to seed and serve, wiped first (default: ./benchmark.db)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per scenario")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    use_database(args.database_url)
+    asyncio.run(main(args))
@@ -0,0 +1,109 @@
+# benchmarks/seed.py
+import argparse
+import asyncio
+import json
+import random
+
+from sqlalchemy import delete, func, insert, select
+
+from app.database import engine, SessionLocal
+from app.facets import rebuild_facets
+from app.locations import resolve_locations
+from app.models import Base, User, Profile, Category, Product, MediaFile, ProductFacet, Location
+from app.passwords import hash_password
+from app.search import create_search_index, rebuild_search_index
+
+# Deterministic benchmark data: the same arguments always produce the same users, categories and products,
+# so numbers from different commits are comparable. Wipes every table of the database it is pointed at
+
+SEED_PASSWORD = "benchmark-password"
+
+WORDS = (
+    "lamp", "chair", "table", "bike", "phone", "laptop", "camera", "guitar", "sofa", "desk",
+    "jacket", "boots", "watch", "mirror", "kettle", "drill", "tent", "stroller", "monitor", "speaker",
+)
+ADJECTIVES = ("vintage", "new", "used", "wooden", "electric", "small", "large", "red", "black", "foldable")
+LOCATIONS = (
+    "Berlin", "Hamburg", "Munich", "Cologne", "Frankfurt", "Stuttgart", "Leipzig", "Dresden", "Bremen", "Hanover",
+)
+
+
+def username(n: int) -> str:
+    return f"bench_user_{n}"
+
+
+async def seed(users: int = 100, categories: int = 20, products: int = 5000, seed: int = 1,
+               batch_size: int = 1000) -> dict:
+    # Returns what the scenarios need to build requests: category ids, locations, words and product id range
+    rng = random.Random(seed)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await create_search_index(conn)
+
+    async with SessionLocal() as db:
+        for model in (ProductFacet, Product, Location, Profile, MediaFile, Category, User):
+            await db.execute(delete(model))
+
+        # One bcrypt hash shared by every user, hashing thousands of them would dominate seeding
+        password = await hash_password(SEED_PASSWORD)
+        user_ids = list(await db.scalars(
+            insert(User).returning(User.id),
+            [{"username": username(n), "password": password} for n in range(users)],
+        ))
+        await db.execute(insert(Profile), [
+            {"user_id": user_id, "profile_picture": "media/profile_pics/default.png"} for user_id in user_ids
+        ])
+        category_ids = list(await db.scalars(
+            insert(Category).returning(Category.id),
+            [{"name": f"Category {n}"} for n in range(categories)],
+        ))
+
+        locations = await resolve_locations(db, LOCATIONS)
+
+        for start in range(0, products, batch_size):
+            rows = []
+            for _ in range(start, min(start + batch_size, products)):
+                word = rng.choice(WORDS)
+                rows.append({
+                    "name": f"{rng.choice(ADJECTIVES).title()} {word}",
+                    "description": " ".join(rng.choice(WORDS + ADJECTIVES) for _ in range(rng.randint(10, 60))),
+                    "price": rng.randint(1, 2000),
+                    "location": rng.choice(LOCATIONS),
+                    "image": "media/product_images/default_product.png",
+                    "category_id": rng.choice(category_ids),
+                    "user_id": rng.choice(user_ids),
+                })
+                rows[-1]["location_id"] = locations[rows[-1]["location"]][0]
+            await db.execute(insert(Product), rows)
+        await rebuild_facets(db)
+        await db.commit()
+
+        first_id, last_id = (await db.execute(select(func.min(Product.id), func.max(Product.id)))).one()
+        await rebuild_search_index(db)
+
+    return {
+        "users": users,
+        "categories": category_ids,
+        "products": products,
+        "product_ids": [first_id, last_id],
+        "locations": list(LOCATIONS),
+        "words": list(WORDS),
+        "seed": seed,
+    }
+
+
+async def main(args):
+    info = await seed(args.users, args.categories, args.products, args.seed)
+    await engine.dispose()
+    print(json.dumps(info))
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.seed --products 20000, against the database in DATABASE_URL
+    parser = argparse.ArgumentParser(description="Fill the database with deterministic benchmark data")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
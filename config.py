@@ -1,8 +1,127 @@
 # config.py
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from starlette.templating import Jinja2Templates
 
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-templates = Jinja2Templates(directory="app/templates")
\ No newline at end of file
+# Connection pool of each database engine (primary and read replica): persistent and burst connections,
+# seconds to wait for one before failing, seconds before a connection is replaced, liveness check on checkout
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 1800
+DB_POOL_PRE_PING = True
+# With DATABASE_READ_URL set, seconds a client keeps reading from the primary after a write
+READ_AFTER_WRITE_SECONDS = 5
+
+# Products per page on the home grid and the /products/feed endpoint
+PAGE_SIZE = 24
+
+# Seconds the category and location lists stay cached between writes
+REFERENCE_CACHE_TTL = 300
+
+# Authenticated users kept in memory so requests skip the user and profile queries
+PRINCIPAL_CACHE_SIZE = 1024
+PRINCIPAL_CACHE_TTL = 60
+# Carry user id and profile picture as JWT claims and trust them without any DB lookup.
+# Claims can only be revoked by expiry (ACCESS_TOKEN_EXPIRE_MINUTES), other workers don't see profile changes
+JWT_PRINCIPAL_CLAIMS = False
+
+# bcrypt work factor, raising it rehashes existing passwords on their next login
+BCRYPT_ROUNDS = 12
+# Threads doing bcrypt work, and how many hash/verify calls may wait before requests get a 503
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_MAX_PENDING = 32
+
+# Largest accepted image upload in bytes, multipart requests over it are cut off while still streaming
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# Widths of the resized WebP/JPEG copies generated for every uploaded image, and the threads generating them
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640)
+IMAGE_DERIVATIVE_WORKERS = 2
+# Images whose finished derivative widths are remembered, and seconds before media_files is asked again
+IMAGE_DERIVATIVE_CACHE_SIZE = 4096
+IMAGE_DERIVATIVE_CACHE_TTL = 10 * 60
+
+# Rendered home and product pages kept for anonymous visitors; writes drop the affected pages right away,
+# the TTL only bounds how long a page waits for its image derivatives to show up
+PAGE_CACHE_SIZE = 512
+PAGE_CACHE_TTL = 60
+
+# Names returned by /locations/suggest, and seconds before the in-memory location index is reloaded to pick up
+# locations other processes created
+LOCATION_SUGGEST_LIMIT = 10
+LOCATION_INDEX_TTL = 5 * 60
+
+# /products/suggest: suggestions returned, distinct product names held in memory (the most common ones when there
+# are more), names with a matching prefix looked at before ranking by product count, and seconds between background
+# reloads picking up other processes' writes
+PRODUCT_SUGGEST_LIMIT = 10
+PRODUCT_SUGGEST_MAX_NAMES = 50_000
+PRODUCT_SUGGEST_SCAN = 200
+PRODUCT_SUGGEST_TTL = 5 * 60
+
+# Streamed pages (app/streaming.py) are sent in chunks of about this many characters between explicit flushes
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Dynamic responses are brotli or gzip compressed from this many bytes, smaller ones aren't worth it
+COMPRESSION_MINIMUM_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# Largest page a /api/v1 client may ask for with ?limit=
+API_MAX_PAGE_SIZE = 100
+
+# SQL statements a request may run before it is reported as a likely N+1, by method and route path. Sized for
+# cold caches, so the result doesn't depend on their TTLs: a logged in request missing the principal cache adds
+# 2 (user, profile), the home page missing the reference cache 2 (categories, facet counts). Product detail and
+# profile pages also read the versions their ETag is made of before loading anything. Pages showing uploaded
+# images read their derivative widths once per image list missing the ready cache (products, home page avatar).
+# QUERY_BUDGET_STRICT=1 in the environment turns an overrun into an error, for test runs
+DEFAULT_QUERY_BUDGET = 10
+QUERY_BUDGETS = {
+    "GET /": 8,
+    "GET /products/detail/{product_id}": 4,
+    "GET /products/feed": 2,
+    "GET /products/suggest": 2,
+    "GET /profile/": 5,
+    "GET /api/v1/products": 1,
+    "GET /api/v1/products/{product_id}": 1,
+    "GET /api/v1/profile": 3,
+    # Writes, at worst with a new category, location and image, replacing an older image
+    "POST /auth/register": 3,
+    "POST /auth/login": 3,
+    "POST /auth/delete_account": 5,
+    "POST /products/new": 11,
+    "POST /products/edit/{product_id}": 14,
+    "POST /products/delete/{product_id}": 6,
+    "POST /profile/": 7,
+}
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT") == "1"
+
+# Deleted products and accounts are hidden at once and purged in the background by app/cleanup.py: rows per
+# purge transaction, and seconds between purge passes when no deletion wakes the worker up
+PURGE_BATCH_SIZE = 500
+PURGE_INTERVAL = 60
+
+# Seconds between sweeps of the upload directories for files no row references, and how old such a file has to
+# be before it goes (uploads are written before their row commits)
+MEDIA_SWEEP_INTERVAL = 6 * 60 * 60
+MEDIA_SWEEP_GRACE = 60 * 60
+
+# Requests taking longer are logged with every SQL statement they ran and its time; None turns the log off
+SLOW_REQUEST_SECONDS = 1.0
+
+# Templates are compiled once into this directory and loaded from there by fresh workers, entries are checked
+# against the template source. None is a per-user directory under the system temp dir
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR")
+
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader("app/templates"),
+    autoescape=True,
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+))